@@ -0,0 +1,77 @@
+"""Anomaly flagging: GL x period amounts scored against each GL code's own history"""
+import numpy as np
+import pandas as pd
+
+from pnl_analysis import GL_LOOKUP, safe_ratio
+
+# Default |score| above which a cell is flagged, per scoring method
+ANOMALY_THRESHOLDS = {'mad': 3.5, 'zscore': 3.0}
+
+# Fewest periods with postings a GL code needs before its cells are scored
+ANOMALY_MIN_PERIODS = 6
+
+# Scale factors turning a median / mean absolute deviation into a normal-consistent spread
+MAD_SCALE = 1.4826
+MEAN_AD_SCALE = 1.2533
+
+def gl_period_matrix(cube):
+    """GL code x period amount matrix from a rollup_cube (NaN where a code has no postings)"""
+    totals = cube['gl_code'].droplevel(['type', 'category'])
+    matrix = totals.unstack(totals.index.names[-1])
+    matrix.index = matrix.index.astype(str)
+    matrix.columns = matrix.columns.astype(str)
+    return matrix.dropna(how='all')
+
+def anomaly_scores(matrix, method='mad'):
+    """Score every cell of a GL x period matrix against its row; returns (scores, expected)
+    
+    'mad' is the robust score (x - median) / (1.4826 x MAD), falling back to the mean absolute
+    deviation when more than half a row is identical; 'zscore' is (x - mean) / std. Rows are
+    scored in one vectorized pass; rows with fewer than ANOMALY_MIN_PERIODS postings or no
+    spread score NaN.
+    """
+    values = matrix.to_numpy(dtype='float64')
+    observed = ~np.isnan(values)
+    if method == 'mad':
+        expected = np.nanmedian(values, axis=1)
+        deviation = np.abs(values - expected[:, None])
+        mad = np.nanmedian(deviation, axis=1) * MAD_SCALE
+        spread = np.where(mad > 0, mad, np.nanmean(deviation, axis=1) * MEAN_AD_SCALE)
+    elif method == 'zscore':
+        expected = np.nanmean(values, axis=1)
+        spread = np.nanstd(values, axis=1)
+    else:
+        raise ValueError(f"Unknown anomaly method: {method}")
+    
+    scores = safe_ratio(values - expected[:, None], spread[:, None], scale=1.0)
+    scores[observed.sum(axis=1) < ANOMALY_MIN_PERIODS] = np.nan
+    return (pd.DataFrame(scores, index=matrix.index, columns=matrix.columns),
+            pd.Series(expected, index=matrix.index))
+
+def flag_anomalies(cube, method='mad', threshold=None, periods=None):
+    """GL x period cells whose |score| exceeds threshold, strongest first, with account attributes
+    
+    Scores use every period of the cube; periods limits the returned cells to those labels.
+    """
+    threshold = ANOMALY_THRESHOLDS[method] if threshold is None else threshold
+    matrix = gl_period_matrix(cube)
+    scores, expected = anomaly_scores(matrix, method)
+    
+    score_values = scores.to_numpy()
+    with np.errstate(invalid='ignore'):
+        rows, cols = np.nonzero(np.abs(score_values) > threshold)
+    flagged = pd.DataFrame({
+        'gl_code': matrix.index[rows],
+        'period': matrix.columns[cols],
+        'amount': matrix.to_numpy()[rows, cols],
+        'expected': expected.to_numpy()[rows],
+        'score': score_values[rows, cols],
+    })
+    if periods is not None:
+        flagged = flagged[flagged['period'].isin(list(periods))]
+    flagged = flagged.iloc[np.argsort(-np.abs(flagged['score'].to_numpy()), kind='stable')]
+    
+    accounts = GL_LOOKUP.reindex(flagged['gl_code'])
+    flagged.insert(1, 'name', accounts['name'].astype(str).to_numpy())
+    flagged.insert(2, 'category', accounts['category'].astype(str).to_numpy())
+    return flagged.reset_index(drop=True)
@@ -0,0 +1,133 @@
+"""Headless batch run of the P&L pipeline over many ledger files
+
+Usage: python batch.py LEDGER_OR_DIR [LEDGER_OR_DIR ...] [--output-dir batch_output] [--workers N] [--fixed-point]
+                       [--consolidate [--eliminate CODE,CODE,...]]
+
+Each file is one entity, named after the file (by relative path where file names collide). Writes metrics.csv, period_metrics.csv
+(when ledgers have a month/period column) and recommendations.csv to the output directory.
+With --consolidate the entities are also consolidated into one group: consolidation.csv holds
+the standalone metrics per entity plus the group P&L, eliminations.csv the intercompany amounts.
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from consolidation import (
+    INTERCOMPANY_GL_CODES,
+    aggregate_entities,
+    combine_entities,
+    consolidation_metrics,
+    eliminate_intercompany,
+    elimination_summary,
+    entity_labels,
+)
+from pnl_analysis import RECOMMENDATION_FIELDS, analyze_ledger_file, render_recommendation
+
+LEDGER_EXTENSIONS = ('.csv', '.xlsx', '.xls')
+
+def collect_ledger_files(paths):
+    """Expand directories into the ledger files they contain (non-recursive, sorted)"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if name.lower().endswith(LEDGER_EXTENSIONS)))
+        else:
+            files.append(path)
+    return files
+
+def recommendation_rows(entity, period, recommendations):
+    """Flatten recommendations into output rows with their rendered text"""
+    return [{'entity': entity, 'period': period,
+             **{field: rec[field] for field in RECOMMENDATION_FIELDS},
+             **render_recommendation(rec)}
+            for rec in recommendations]
+
+def run_batch(files, workers=None, sheet_name=0, stream=False, fixed_point=False):
+    """Analyze ledger files across a process pool; returns (metrics, period_metrics, recommendations, errors)"""
+    entities = dict(zip(files, entity_labels(files)))
+    metrics_rows, period_frames, rec_rows, errors = [], [], [], {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(analyze_ledger_file, path, sheet_name, stream, fixed_point): path for path in files}
+        for future in as_completed(futures):
+            path = futures[future]
+            entity = entities[path]
+            try:
+                result = future.result()
+            except Exception as e:
+                errors[path] = str(e)
+                continue
+            
+            metrics_rows.append({'entity': entity, 'file': path, 'rows': result['rows'],
+                                 'unknown_codes': len(result['unknown_codes']), **result['metrics']})
+            rec_rows.extend(recommendation_rows(entity, 'All', result['recommendations']))
+            if 'metrics_by_period' in result:
+                period_frames.append(result['metrics_by_period'].rename_axis('period').reset_index()
+                                     .assign(entity=entity))
+                for period, recs in result['recommendations_by_period'].items():
+                    rec_rows.extend(recommendation_rows(entity, period, recs))
+    
+    metrics = pd.DataFrame(metrics_rows)
+    if len(metrics):
+        metrics = metrics.sort_values('entity', ignore_index=True)
+    period_metrics = pd.concat(period_frames, ignore_index=True) if period_frames else None
+    if period_metrics is not None:
+        period_metrics['period'] = period_metrics['period'].astype(str)
+        period_metrics = period_metrics[['entity'] + [c for c in period_metrics.columns if c != 'entity']]
+        period_metrics = period_metrics.sort_values('entity', kind='stable', ignore_index=True)
+    return metrics, period_metrics, pd.DataFrame(rec_rows), errors
+
+def run_consolidation(files, workers=None, sheet_name=0, fixed_point=False, eliminate=INTERCOMPANY_GL_CODES):
+    """Consolidate ledger files as entities of one group; returns (entity and group metrics, eliminations)"""
+    ledgers = {entity: (path, os.path.basename(path)) for entity, path in zip(entity_labels(files), files)}
+    results = aggregate_entities(ledgers, workers, sheet_name, fixed_point)
+    group = combine_entities({entity: aggregates for entity, (aggregates, _) in results.items()})
+    consolidated, eliminated = eliminate_intercompany(group, eliminate)
+    return consolidation_metrics(consolidated, eliminated), elimination_summary(eliminated)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the P&L pipeline over many ledger files")
+    parser.add_argument('paths', nargs='+', help="Ledger files or directories of ledgers")
+    parser.add_argument('--output-dir', default='batch_output')
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--sheet', default=0, help="Excel worksheet name or index (default: first sheet)")
+    parser.add_argument('--stream', action='store_true', help="Stream CSV ledgers in chunks")
+    parser.add_argument('--fixed-point', action='store_true', help="Sum amounts exactly as integer cents")
+    parser.add_argument('--consolidate', action='store_true', help="Also consolidate the ledgers as one group")
+    parser.add_argument('--eliminate', default=','.join(INTERCOMPANY_GL_CODES),
+                        help="Comma-separated intercompany GL codes to eliminate on consolidation")
+    args = parser.parse_args(argv)
+    
+    files = collect_ledger_files(args.paths)
+    if not files:
+        parser.error("no ledger files found")
+    try:
+        entity_labels(files)
+    except ValueError as e:
+        parser.error(str(e))
+    sheet_name = int(args.sheet) if str(args.sheet).isdigit() else args.sheet
+    
+    metrics, period_metrics, recommendations, errors = run_batch(files, args.workers, sheet_name, args.stream,
+                                                                 args.fixed_point)
+    
+    os.makedirs(args.output_dir, exist_ok=True)
+    metrics.to_csv(os.path.join(args.output_dir, 'metrics.csv'), index=False)
+    recommendations.to_csv(os.path.join(args.output_dir, 'recommendations.csv'), index=False)
+    if period_metrics is not None:
+        period_metrics.to_csv(os.path.join(args.output_dir, 'period_metrics.csv'), index=False)
+    if args.consolidate and not errors:
+        eliminate = [code.strip() for code in args.eliminate.split(',') if code.strip()]
+        consolidation, eliminations = run_consolidation(files, args.workers, sheet_name, args.fixed_point, eliminate)
+        consolidation.to_csv(os.path.join(args.output_dir, 'consolidation.csv'))
+        eliminations.to_csv(os.path.join(args.output_dir, 'eliminations.csv'))
+    
+    print(f"Analyzed {len(metrics)} of {len(files)} ledgers -> {args.output_dir}")
+    for path, message in errors.items():
+        print(f"  failed: {path}: {message}", file=sys.stderr)
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
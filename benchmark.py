@@ -0,0 +1,217 @@
+"""Time the analysis pipeline stage by stage on synthetic GL ledgers
+
+Usage: python benchmark.py [--rows 10000 100000 1000000] [--months 12] [--unknown-share 0.01]
+                           [--output benchmark_results.json] [--compare OLD_RESULTS.json] [--no-trace]
+
+Ledgers are generated in chunks into a temporary CSV, so sizes up to tens of millions of rows
+only need memory for the pipeline itself. Each stage reports wall time, rows/sec and (unless
+--no-trace) the peak memory traced while it ran; results are written as JSON so runs of two
+versions can be compared with --compare.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from pnl_analysis import (
+    GL_LOOKUP,
+    calculate_metrics,
+    calculate_metrics_by_period,
+    enrich_ledger,
+    generate_optimization_recommendations,
+    generate_recommendations_by_period,
+    index_periods,
+    normalize_columns,
+    parse_ledger_periods,
+    peak_rss_bytes,
+    rank_totals,
+    read_ledger,
+    rollup_cube,
+    rollup_slice,
+    view_gl_totals,
+)
+from variance import cube_periods
+
+# Rows generated per chunk when writing a synthetic ledger
+GENERATE_CHUNK_ROWS = 1_000_000
+
+# Codes outside GL_CODE_MAPPING used as unknown-code noise
+UNKNOWN_CODES = np.array([str(code) for code in range(99000, 99100) if str(code) not in GL_LOOKUP.index])
+
+# Total magnitude per account type relative to revenue (an airline-like cost structure)
+TYPE_MIX = {'Revenue': 1.0, 'COGS': 0.55, 'OPEX': 0.3, 'D&A': 0.06, 'Interest': 0.03, 'Non-Operating': 0.01}
+
+def account_profile():
+    """Sign convention and amount scale per GL_LOOKUP account
+    
+    Income is positive, costs negative and non-operating either way (0); scales make each
+    type's total follow TYPE_MIX whatever its number of accounts.
+    """
+    types = GL_LOOKUP['type'].astype(str)
+    income = (types == 'Revenue') | (GL_LOOKUP['category'].astype(str) == 'Interest Income')
+    signs = np.where(types == 'Non-Operating', 0, np.where(income, 1, -1))
+    scales = types.map(TYPE_MIX).fillna(0.0) * len(types) / types.map(types.value_counts())
+    return signs, scales.to_numpy()
+
+def make_ledger(rows, months=12, unknown_share=0.01, reversal_share=0.02, start='2024-01', seed=0):
+    """Synthetic raw ledger (GL Code, Amount, Month) drawn from GL_CODE_MAPPING
+    
+    Amounts are lognormal, scaled and signed per account (see account_profile); a share of
+    lines are reversals (flipped sign) and a share carry codes missing from the mapping.
+    """
+    rng = np.random.default_rng(seed)
+    accounts = rng.integers(0, len(GL_LOOKUP), rows)
+    signs, scales = account_profile()
+    signs, scales = signs[accounts], scales[accounts]
+    signs = np.where(signs == 0, rng.choice([-1, 1], rows), signs)
+    signs = np.where(rng.random(rows) < reversal_share, -signs, signs)
+    
+    codes = GL_LOOKUP.index.to_numpy()[accounts]
+    unknown = rng.random(rows) < unknown_share
+    codes[unknown] = rng.choice(UNKNOWN_CODES, unknown.sum())
+    
+    labels = pd.period_range(start, periods=months, freq='M').strftime('%Y-%m').to_numpy()
+    return pd.DataFrame({
+        'GL Code': codes,
+        'Amount': np.round(rng.lognormal(8, 1.5, rows) * scales, 2) * signs,
+        'Month': labels[rng.integers(0, months, rows)],
+    })
+
+def write_ledger_csv(path, rows, chunk_rows=GENERATE_CHUNK_ROWS, seed=0, **options):
+    """Write a synthetic ledger to CSV chunk by chunk (options as for make_ledger)"""
+    for i, start in enumerate(range(0, rows, chunk_rows)):
+        chunk = make_ledger(min(chunk_rows, rows - start), seed=seed + i, **options)
+        chunk.to_csv(path, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+
+def chart_data(cube, periods=None):
+    """The app's chart inputs for one period view: category slice, GL slice and its top line items"""
+    return rollup_slice(cube, 'category', periods), rank_totals(view_gl_totals(cube, periods), 10)
+
+def run_stages(data, file_name, rows, trace=True):
+    """Run the pipeline over raw file bytes, timing each stage; returns a list of stage results"""
+    results = []
+    
+    def stage(name, fn):
+        if trace:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        value = fn()
+        seconds = time.perf_counter() - start
+        results.append({
+            'stage': name,
+            'seconds': seconds,
+            'rows_per_sec': rows / seconds if seconds > 0 else None,
+            'peak_mb': (tracemalloc.get_traced_memory()[1] - baseline) / 1e6 if trace else None,
+        })
+        return value
+    
+    # Same steps as prepare_ledger + index_periods in the app, timed separately
+    raw_df = stage('read', lambda: read_ledger(data, file_name))
+    raw_df, _ = stage('periods', lambda: parse_ledger_periods(normalize_columns(raw_df)))
+    df, _ = stage('enrichment', lambda: enrich_ledger(raw_df))
+    del raw_df
+    df, _ = stage('period_index', lambda: index_periods(df))
+    metrics = stage('metrics', lambda: calculate_metrics(df))
+    metrics_by_period = stage('period_metrics', lambda: calculate_metrics_by_period(df))
+    stage('recommendations', lambda: (generate_optimization_recommendations(df, metrics),
+                                      generate_recommendations_by_period(df, metrics_by_period)))
+    cube = stage('rollup_cube', lambda: rollup_cube(df))
+    # All periods plus each single period, as the app slices the cube per view
+    views = [None] + [[period] for period in cube_periods(cube) or []]
+    stage('chart_data', lambda: [chart_data(cube, periods) for periods in views])
+    return results
+
+def benchmark(rows, months=12, unknown_share=0.01, trace=True, seed=0):
+    """Generate a ledger of the given size and time the pipeline over it"""
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'ledger.csv')
+        write_ledger_csv(path, rows, months=months, unknown_share=unknown_share, seed=seed)
+        with open(path, 'rb') as f:
+            data = f.read()
+    
+    if trace:
+        tracemalloc.start()
+    try:
+        stages = run_stages(data, 'ledger.csv', rows, trace)
+    finally:
+        if trace:
+            tracemalloc.stop()
+    total = sum(s['seconds'] for s in stages)
+    rss = peak_rss_bytes()
+    return {
+        'rows': rows,
+        'file_mb': len(data) / 1e6,
+        'total_seconds': total,
+        'rows_per_sec': rows / total if total > 0 else None,
+        'peak_rss_mb': rss / 1e6 if rss is not None else None,
+        'stages': stages,
+    }
+
+def git_revision():
+    """Current commit of the working tree (None outside a git checkout)"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(result, baseline=None):
+    """Print one size's stage table, with the time ratio against a baseline run when given"""
+    print(f"\n{result['rows']:,} rows ({result['file_mb']:.1f} MB CSV): {result['total_seconds']:.3f}s total, "
+          f"{result['rows_per_sec']:,.0f} rows/s")
+    previous = {s['stage']: s for s in baseline['stages']} if baseline else {}
+    for s in result['stages']:
+        line = f"  {s['stage']:<16}{s['seconds']:>9.3f}s{s['rows_per_sec'] or 0:>14,.0f} rows/s"
+        if s['peak_mb'] is not None:
+            line += f"{s['peak_mb']:>10.1f} MB"
+        if s['stage'] in previous and previous[s['stage']]['seconds'] > 0:
+            line += f"{s['seconds'] / previous[s['stage']]['seconds']:>8.2f}x vs baseline"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--months', type=int, default=12)
+    parser.add_argument('--unknown-share', type=float, default=0.01, help="Share of lines with unmapped GL codes")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help="Earlier results JSON to compare stage times against")
+    parser.add_argument('--no-trace', action='store_true', help="Skip per-stage memory tracing (lower overhead)")
+    args = parser.parse_args()
+    
+    baselines = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baselines = {r['rows']: r for r in json.load(f)['results']}
+    
+    results = []
+    for rows in args.rows:
+        result = benchmark(rows, args.months, args.unknown_share, not args.no_trace, args.seed)
+        print_results(result, baselines.get(rows))
+        results.append(result)
+    
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'settings': {'months': args.months, 'unknown_share': args.unknown_share, 'seed': args.seed,
+                     'traced': not args.no_trace},
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+if __name__ == '__main__':
+    main()
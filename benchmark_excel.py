@@ -0,0 +1,82 @@
+"""Compare the default pd.read_excel path with the projected/parallel Excel reader
+
+Usage: python benchmark_excel.py [--rows 100000] [--sheets 12] [--repeat 3] [--workers N]
+
+The engine gain (openpyxl -> fastest installed engine, both read serially) and the parallel
+gain (serial -> worker processes, same engine) are reported separately.
+"""
+import argparse
+import io
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from pnl_analysis import GL_CODE_MAPPING, fastest_excel_engine, read_excel_ledger
+
+def make_workbook(rows, sheets, seed=0):
+    """Build an in-memory workbook: one sheet per month plus columns the app ignores"""
+    rng = np.random.default_rng(seed)
+    codes = np.array(list(GL_CODE_MAPPING))
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        for i in range(sheets):
+            n = rows // sheets
+            month = f"{2024 + i // 12}-{i % 12 + 1:02d}"
+            pd.DataFrame({
+                'GL Code': rng.choice(codes, n),
+                'Description': rng.choice(['Accrual', 'Invoice', 'Journal', 'Reversal'], n),
+                'Cost Centre': rng.integers(1000, 9999, n),
+                'Amount': np.round(rng.normal(0, 10000, n), 2),
+                'Month': month,
+            }).to_excel(writer, sheet_name=month, index=False)
+    return buffer.getvalue()
+
+def best_of(fn, repeat):
+    """Best wall time over several runs"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--sheets', type=int, default=12)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    args = parser.parse_args()
+    
+    data = make_workbook(args.rows, args.sheets)
+    engine = fastest_excel_engine()
+    workers = min(args.sheets, args.workers or os.cpu_count() or 1)
+    print(f"{args.rows:,} rows across {args.sheets} sheets ({len(data) / 1e6:.1f} MB), engine={engine}, "
+          f"workers={workers}")
+    
+    cases = {
+        'pd.read_excel (first sheet)': lambda: pd.read_excel(io.BytesIO(data)),
+        'read_excel_ledger (first sheet, openpyxl)': lambda: read_excel_ledger(data, engine='openpyxl'),
+        f'read_excel_ledger (first sheet, {engine})': lambda: read_excel_ledger(data, engine=engine),
+        'pd.read_excel (all sheets)': lambda: pd.concat(pd.read_excel(io.BytesIO(data), sheet_name=None).values()),
+        'read_excel_ledger (all sheets, openpyxl, serial)':
+            lambda: read_excel_ledger(data, None, engine='openpyxl', workers=1),
+        f'read_excel_ledger (all sheets, {engine}, serial)': lambda: read_excel_ledger(data, None, engine, workers=1),
+        f'read_excel_ledger (all sheets, {engine}, {workers} processes)':
+            lambda: read_excel_ledger(data, None, engine, workers=workers),
+    }
+    times = {}
+    for label, fn in cases.items():
+        times[label] = best_of(fn, args.repeat)
+        print(f"{label:<55}{times[label]:>8.3f}s")
+    
+    serial = times[f'read_excel_ledger (all sheets, {engine}, serial)']
+    engine_gain = times['read_excel_ledger (all sheets, openpyxl, serial)'] / serial
+    parallel_gain = serial / times[f'read_excel_ledger (all sheets, {engine}, {workers} processes)']
+    print(f"\nengine gain (openpyxl -> {engine}, serial): {engine_gain:.2f}x")
+    print(f"parallel gain ({engine}, serial -> {workers} processes): {parallel_gain:.2f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Multi-entity consolidation: per-entity aggregation in parallel, intercompany elimination, group P&L"""
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from pnl_analysis import (
+    GL_LOOKUP,
+    aggregate_ledger,
+    aggregate_pl_lines,
+    calculate_metrics,
+    derive_metrics,
+    period_columns,
+    prepare_ledger,
+    read_ledger,
+    sum_amounts,
+)
+
+# GL codes booked between group companies (management fees and shared-service recharges);
+# consolidation removes them from the group P&L
+INTERCOMPANY_GL_CODES = ['41801', '61411', '61425', '61426']
+
+# Row label of the consolidated P&L in consolidation_metrics
+GROUP_ROW = 'Group'
+
+def entity_labels(paths):
+    """Entity label per ledger path or file name: its stem, or its relative path where stems collide
+    
+    ledger.csv next to ledger.xlsx become 'ledger.csv' and 'ledger.xlsx'; dirA/ledger.csv and
+    dirB/ledger.csv become 'dirA/ledger.csv' and 'dirB/ledger.csv'. Raises ValueError when two
+    ledgers still share a label (the same file given twice).
+    """
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    clashing = [os.path.abspath(path) for path, stem in zip(paths, stems) if stems.count(stem) > 1]
+    root = os.path.commonpath([os.path.dirname(path) for path in clashing]) if clashing else None
+    labels = [os.path.relpath(os.path.abspath(path), root).replace(os.sep, '/') if stems.count(stem) > 1 else stem
+              for path, stem in zip(paths, stems)]
+    duplicates = sorted(label for label, count in Counter(labels).items() if count > 1)
+    if duplicates:
+        raise ValueError(f"Duplicate entity ledgers: {', '.join(duplicates)}")
+    return labels
+
+def aggregate_entity_ledger(source, file_name, sheet_name=0, fixed_point=False):
+    """Read, enrich and aggregate one entity ledger (file bytes or a path); returns (aggregates, unknown_codes)"""
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            source = f.read()
+    df, unknown_codes, _ = prepare_ledger(read_ledger(source, file_name, sheet_name), fixed_point)
+    return aggregate_ledger(df), unknown_codes
+
+def aggregate_entities(ledgers, workers=None, sheet_name=0, fixed_point=False):
+    """Aggregate entity ledgers across worker processes, one entity per task
+    
+    ledgers maps entity -> (file bytes or path, file name). Returns {entity: (aggregates, unknown_codes)}
+    in the order of ledgers.
+    """
+    if len(ledgers) == 1:
+        entity, (source, file_name) = next(iter(ledgers.items()))
+        return {entity: aggregate_entity_ledger(source, file_name, sheet_name, fixed_point)}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {entity: pool.submit(aggregate_entity_ledger, source, file_name, sheet_name, fixed_point)
+                   for entity, (source, file_name) in ledgers.items()}
+        return {entity: future.result() for entity, future in futures.items()}
+
+def combine_entities(aggregates):
+    """Stack per-entity aggregates into one group ledger with a categorical entity column
+    
+    A ledger that already carries an entity column keeps it; month labels are re-coded across
+    all entities so periods line up.
+    """
+    if len({'period' in frame.columns for frame in aggregates.values()}) > 1:
+        raise ValueError("Entity ledgers must all have, or all lack, a month/period column")
+    
+    frames = [frame if 'entity' in frame.columns else frame.assign(entity=entity)
+              for entity, frame in aggregates.items()]
+    group = pd.concat(frames, ignore_index=True)
+    entities = pd.unique(pd.concat([frame['entity'].astype(str) for frame in frames]))
+    group['entity'] = pd.Categorical(group['entity'].astype(str), categories=entities)
+    if 'period' in group.columns:
+        group['month_name'], group['year_month'] = period_columns(group['period'])
+    return group
+
+def eliminate_intercompany(ledger, codes=INTERCOMPANY_GL_CODES):
+    """Split a group ledger into (consolidated rows, eliminated intercompany rows)"""
+    intercompany = ledger['gl_code'].astype(str).isin(list(codes)).to_numpy()
+    return ledger[~intercompany], ledger[intercompany]
+
+def consolidation_metrics(consolidated, eliminated):
+    """calculate_metrics per entity (standalone, before eliminations) plus the GROUP_ROW group P&L
+    
+    One row per entity and a final row for the consolidated ledger; columns are the
+    calculate_metrics keys.
+    """
+    standalone = pd.concat([consolidated, eliminated], ignore_index=True)
+    by_entity = derive_metrics(aggregate_pl_lines(standalone, by='entity'))
+    by_entity.index = by_entity.index.astype(str)
+    group = pd.DataFrame([calculate_metrics(consolidated)], index=[GROUP_ROW])
+    return pd.concat([by_entity, group]).rename_axis('entity')
+
+def elimination_summary(eliminated):
+    """Eliminated amount per intercompany GL code and entity, with the net left unmatched"""
+    if len(eliminated) == 0:
+        return pd.DataFrame(columns=['name', 'net'])
+    totals = sum_amounts(eliminated, ['gl_code', 'entity']).unstack('entity', fill_value=0.0)
+    totals.index = totals.index.astype(str)
+    totals.columns = totals.columns.astype(str)
+    summary = totals.assign(net=totals.sum(axis=1))
+    summary.insert(0, 'name', GL_LOOKUP['name'].reindex(summary.index).astype(str).to_numpy())
+    return summary
+
+def unknown_entity_codes(results):
+    """Distinct unknown GL codes across aggregate_entities results"""
+    codes = [np.asarray(unknown, dtype=object) for _, unknown in results.values()]
+    return np.array(sorted(set(np.concatenate(codes)) if codes else []), dtype=object)
@@ -0,0 +1,169 @@
+"""Partitioned Parquet store for enriched ledgers
+
+Layout: <store>/entity=<entity>/year_month=<YYYY-MM>/part-0.parquet. Saving a ledger only
+replaces the (entity, month) partitions it contains, so new months append without
+rewriting history. Loads prune partitions by entity and period and read only the
+requested columns.
+
+Per-period aggregates (GL totals and calculate_metrics outputs) live under
+<store>/_aggregates/{gl_totals,metrics}/ with the same partitioning, so a new month can
+be merged into an entity's history without touching earlier months.
+"""
+import os
+from urllib.parse import quote, unquote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from pnl_analysis import (
+    GL_ATTRIBUTES,
+    GL_LOOKUP,
+    amount_scale,
+    amount_units,
+    calculate_metrics_by_period,
+    map_gl_codes,
+    parse_periods,
+    period_columns,
+    sum_amounts,
+)
+
+DEFAULT_STORE_PATH = 'ledger_store'
+
+# Row-level columns kept in the store; entity and year_month live in the partition path
+STORE_COLUMNS = ['gl_code', 'amount', 'name', 'category', 'type']
+
+PARTITIONING = ds.partitioning(pa.schema([('entity', pa.string()), ('year_month', pa.string())]), flavor='hive')
+
+def save_ledger(df, store_path, entity):
+    """Write an enriched ledger into the store, replacing only the months it contains
+    
+    Amounts are always stored as float64 currency units: compact (float32) and fixed-point
+    ledgers only change what a session holds in memory, never what is persisted.
+    """
+    if 'year_month' not in df.columns:
+        raise ValueError("Only ledgers with a month/period column can be saved to the store")
+    
+    amounts = amount_units(df['amount'].astype('float64'), amount_scale(df))
+    frame = df[STORE_COLUMNS].assign(amount=amounts, entity=str(entity), year_month=df['year_month'].astype(str))
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    ds.write_dataset(table, store_path, format='parquet', partitioning=PARTITIONING,
+                     existing_data_behavior='delete_matching', basename_template='part-{i}.parquet')
+
+def _partition_dir(key, value):
+    """Directory name of a hive partition; values are URI-encoded exactly as pyarrow writes them"""
+    return f"{key}={quote(str(value), safe='')}"
+
+def _partition_values(path, key):
+    """Decoded values of a hive partition key from the directory names under path"""
+    if not os.path.isdir(path):
+        return []
+    prefix = f"{key}="
+    return sorted(unquote(name[len(prefix):]) for name in os.listdir(path)
+                  if name.startswith(prefix) and os.path.isdir(os.path.join(path, name)))
+
+def list_entities(store_path):
+    """Entities present in the store"""
+    return _partition_values(store_path, 'entity')
+
+def list_periods(store_path, entity):
+    """Stored months ('YYYY-MM', ascending) for an entity"""
+    return _partition_values(os.path.join(store_path, _partition_dir('entity', entity)), 'year_month')
+
+def store_fingerprint(store_path, entity):
+    """Cheap change marker for an entity's partitions (names and modification times)"""
+    fingerprint = []
+    entity_path = os.path.join(store_path, _partition_dir('entity', entity))
+    for period in list_periods(store_path, entity):
+        period_path = os.path.join(entity_path, _partition_dir('year_month', period))
+        fingerprint.extend((period, entry.name, entry.stat().st_mtime_ns) for entry in os.scandir(period_path))
+    return tuple(fingerprint)
+
+def load_ledger_store(store_path, entities=None, start=None, end=None, columns=None):
+    """Load stored ledgers, pruning partitions by entity and month range ('YYYY-MM', inclusive)
+    
+    Returns a ledger shaped like prepare_ledger output (period, month_name, year_month and
+    categorical GL attributes) plus an entity column.
+    """
+    dataset = ds.dataset(store_path, format='parquet', partitioning=PARTITIONING)
+    
+    condition = None
+    for clause in [
+        ds.field('entity').isin(list(entities)) if entities else None,
+        ds.field('year_month') >= start if start else None,
+        ds.field('year_month') <= end if end else None,
+    ]:
+        if clause is not None:
+            condition = clause if condition is None else condition & clause
+    
+    columns = list(columns) if columns else STORE_COLUMNS
+    table = dataset.to_table(columns=list(dict.fromkeys(columns + ['entity', 'year_month'])), filter=condition)
+    df = table.to_pandas()
+    
+    for col in GL_ATTRIBUTES:
+        if col in df.columns:
+            df[col] = df[col].astype(GL_LOOKUP[col].dtype)
+    df['period'] = parse_periods(df['year_month'].astype(str))
+    df['month_name'], df['year_month'] = period_columns(df['period'])
+    return df
+
+# Aggregate tables; the leading underscore keeps them out of ledger partition discovery
+AGGREGATES_DIR = '_aggregates'
+
+def _aggregate_path(store_path, table):
+    return os.path.join(store_path, AGGREGATES_DIR, table)
+
+def _restore_periods(df):
+    """Rebuild period/month_name/year_month from the year_month partition column"""
+    df['period'] = parse_periods(df['year_month'].astype(str))
+    df['month_name'], df['year_month'] = period_columns(df['period'])
+    return df
+
+def save_period_aggregates(df, store_path, entity):
+    """Aggregate only the months in df and merge them into the entity's stored history
+    
+    Writes per-(month, gl_code) totals and the calculate_metrics outputs for each month,
+    replacing any earlier aggregates for those months. Returns the months written.
+    """
+    if 'year_month' not in df.columns:
+        raise ValueError("Only ledgers with a month/period column can be merged into the store")
+    
+    line_count = df['line_count'] if 'line_count' in df.columns else pd.Series(1, index=df.index)
+    gl_totals = pd.DataFrame({
+        'amount': sum_amounts(df, ['year_month', 'gl_code']),
+        'line_count': line_count.groupby([df['year_month'], df['gl_code']], observed=True).sum(),
+    }).reset_index()
+    gl_totals['gl_code'] = gl_totals['gl_code'].astype(str)
+    metrics = calculate_metrics_by_period(df, 'year_month').reset_index()
+    
+    for table, frame in [('gl_totals', gl_totals), ('metrics', metrics)]:
+        frame = frame.assign(entity=str(entity), year_month=frame['year_month'].astype(str))
+        ds.write_dataset(pa.Table.from_pandas(frame, preserve_index=False), _aggregate_path(store_path, table),
+                         format='parquet', partitioning=PARTITIONING,
+                         existing_data_behavior='delete_matching', basename_template='part-{i}.parquet')
+    return sorted(metrics['year_month'].astype(str))
+
+def list_aggregated_periods(store_path, entity):
+    """Months with stored aggregates for an entity ('YYYY-MM', ascending)"""
+    entity_path = os.path.join(_aggregate_path(store_path, 'metrics'), _partition_dir('entity', entity))
+    return _partition_values(entity_path, 'year_month')
+
+def aggregates_fingerprint(store_path, entity):
+    """Change marker for an entity's stored aggregates"""
+    return store_fingerprint(_aggregate_path(store_path, 'metrics'), entity)
+
+def _load_aggregate_table(store_path, table, entity):
+    dataset = ds.dataset(_aggregate_path(store_path, table), format='parquet', partitioning=PARTITIONING)
+    return dataset.to_table(filter=ds.field('entity') == str(entity)).to_pandas()
+
+def load_period_metrics(store_path, entity):
+    """Stored per-period metrics for an entity, indexed by month label in calendar order"""
+    metrics = _restore_periods(_load_aggregate_table(store_path, 'metrics', entity))
+    metrics = metrics.sort_values('period').set_index('month_name')
+    return metrics.drop(columns=['entity', 'year_month', 'period'])
+
+def load_period_aggregates(store_path, entity):
+    """Stored per-(month, gl_code) totals for an entity as a ledger-shaped frame"""
+    gl_totals = _restore_periods(_load_aggregate_table(store_path, 'gl_totals', entity))
+    gl_totals[GL_ATTRIBUTES] = map_gl_codes(gl_totals['gl_code'])
+    return gl_totals.drop(columns=['entity'])
@@ -4,330 +4,431 @@ import plotly.graph_objects as go
 import plotly.express as px
 from datetime import datetime
 import numpy as np
+import hashlib
+import io
+import os
+
+from pnl_analysis import (
+    AMOUNT_SCALE,
+    GL_LOOKUP,
+    METRIC_WINDOWS,
+    TREND_COLUMNS,
+    amount_scale,
+    amount_units,
+    calculate_metrics,
+    calculate_metrics_by_period,
+    compact_ledger,
+    detail_spill_path,
+    excel_sheet_names,
+    fastest_excel_engine,
+    generate_optimization_recommendations,
+    gl_rows,
+    index_gl_rows,
+    index_periods,
+    ledger_csv,
+    memory_report,
+    metric_growth,
+    peak_rss_bytes,
+    prepare_ledger,
+    rank_totals,
+    read_ledger,
+    recommendations_frame,
+    render_recommendation,
+    rollup_cube,
+    rollup_lines_by_period,
+    rollup_slice,
+    safe_ratio,
+    search_gl_codes,
+    slice_periods,
+    stream_csv_ledger,
+    to_minor_units,
+    type_totals,
+    view_gl_totals,
+    with_amount_scale,
+    window_metrics,
+)
+from anomalies import ANOMALY_MIN_PERIODS, ANOMALY_THRESHOLDS, flag_anomalies
+from variance import align_budget, category_variance, metric_variance, variance_bridge
+from consolidation import (
+    INTERCOMPANY_GL_CODES,
+    aggregate_entities,
+    combine_entities,
+    consolidation_metrics,
+    eliminate_intercompany,
+    elimination_summary,
+    entity_labels,
+    unknown_entity_codes,
+)
+from ledger_store import (
+    DEFAULT_STORE_PATH,
+    aggregates_fingerprint,
+    list_aggregated_periods,
+    list_entities,
+    list_periods,
+    load_ledger_store,
+    load_period_aggregates,
+    load_period_metrics,
+    save_ledger,
+    save_period_aggregates,
+    store_fingerprint,
+)
 
 # Page configuration
 st.set_page_config(page_title="P&L Profitability Analyzer", layout="wide", initial_sidebar_state="expanded")
 
-# GL Code Mapping with Categories
-GL_CODE_MAPPING = {
-    # Revenue Categories
-    '41110': {'name': 'Scheduled Flight', 'category': 'Flight Revenue', 'type': 'Revenue'},
-    '41116': {'name': 'Revenue - Loyalty Point Redemption', 'category': 'Flight Revenue', 'type': 'Revenue'},
-    '41150': {'name': 'Refund and Chargeback', 'category': 'Flight Revenue', 'type': 'Revenue'},
-    '41151': {'name': 'Refund', 'category': 'Flight Revenue', 'type': 'Revenue'},
-    '4160C': {'name': 'Travel, Lifestyle and Shopping', 'category': 'Non-Airline Direct Revenue', 'type': 'Revenue'},
-    '41641': {'name': 'Commission', 'category': 'Non-Airline Direct Revenue', 'type': 'Revenue'},
-    '41643': {'name': 'Gross Billing - Merchandise', 'category': 'Non-Airline Direct Revenue', 'type': 'Revenue'},
-    '41648': {'name': 'Inflight Shopping Commission', 'category': 'Non-Airline Direct Revenue', 'type': 'Revenue'},
-    '41654': {'name': 'Gross Billing - Discount Pass', 'category': 'Non-Airline Direct Revenue', 'type': 'Revenue'},
-    '41658': {'name': 'Advertising and Partnerships', 'category': 'Non-Airline Direct Revenue', 'type': 'Revenue'},
-    '41649': {'name': 'Inflight Shopping Merchant Fees', 'category': 'Non-Airline Direct Revenue', 'type': 'Revenue'},
-    '41651': {'name': 'Refund', 'category': 'Non-Airline Direct Revenue', 'type': 'Revenue'},
-    '41675': {'name': 'Revenue - Discount', 'category': 'Non-Airline Direct Revenue', 'type': 'Revenue'},
-    '41332': {'name': 'Revenue - Inflight Duty Free Onboard', 'category': 'Non-Inflight Revenues', 'type': 'Revenue'},
-    '41321': {'name': 'Revenue - Inflight Merchandise Pre-book', 'category': 'Non-Inflight Revenues', 'type': 'Revenue'},
-    '41322': {'name': 'Revenue - Inflight Merchandise Onboard', 'category': 'Non-Inflight Revenues', 'type': 'Revenue'},
-    '41331': {'name': 'Revenue - Inflight Duty Free Pre-book', 'category': 'Non-Inflight Revenues', 'type': 'Revenue'},
-    '41264': {'name': 'Revenue - Service Fees', 'category': 'Non-Inflight Revenues', 'type': 'Revenue'},
-    '42114': {'name': 'Advertising - Publication', 'category': 'Non-Inflight Revenues', 'type': 'Revenue'},
-    '41801': {'name': 'Management Fee', 'category': 'Non-Inflight Revenues', 'type': 'Revenue'},
-    '45130': {'name': 'Gain / (Loss) on Disposal', 'category': 'Other Income', 'type': 'Revenue'},
-    '45132': {'name': 'Other Income - Gain/(Loss) on Asset Disposal', 'category': 'Other Income', 'type': 'Revenue'},
-    '45150': {'name': 'Others', 'category': 'Other Income', 'type': 'Revenue'},
-    '45199': {'name': 'Other Income - Others', 'category': 'Other Income', 'type': 'Revenue'},
-    
-    # Cost of Sales
-    '51711': {'name': 'Credit Card Commission', 'category': 'Sales And Distribution', 'type': 'COGS'},
-    '51621': {'name': 'Inflight Merchandise', 'category': 'Sales And Distribution', 'type': 'COGS'},
-    '51631': {'name': 'Duty Free', 'category': 'Sales And Distribution', 'type': 'COGS'},
-    '51664': {'name': 'Merchandise', 'category': 'Sales And Distribution', 'type': 'COGS'},
-    '51717': {'name': 'Commission paid to Partner', 'category': 'Sales And Distribution', 'type': 'COGS'},
-    '51718': {'name': 'Payment Gateway Fee', 'category': 'Sales And Distribution', 'type': 'COGS'},
-    '51719': {'name': 'Commission to AA.Com', 'category': 'Sales And Distribution', 'type': 'COGS'},
-    '51726': {'name': 'Collection Shortage', 'category': 'Sales And Distribution', 'type': 'COGS'},
-    '51749': {'name': 'Other Distribution Cost', 'category': 'Sales And Distribution', 'type': 'COGS'},
-    '51754': {'name': 'Merchant Fee', 'category': 'Sales And Distribution', 'type': 'COGS'},
-    '51256': {'name': 'Travelling - Others', 'category': 'Sales And Distribution', 'type': 'COGS'},
-    '51536': {'name': 'Freight Charges', 'category': 'Sales And Distribution', 'type': 'COGS'},
-    '51610': {'name': 'Inflight Meal and Beverage', 'category': 'Sales And Distribution', 'type': 'COGS'},
-    '51615': {'name': 'Inflight Amenities', 'category': 'Sales And Distribution', 'type': 'COGS'},
-    '51640': {'name': 'Other Inflight Cost', 'category': 'Sales And Distribution', 'type': 'COGS'},
-    '51648': {'name': 'Other Operating Cost - Inflight', 'category': 'Sales And Distribution', 'type': 'COGS'},
-    '51912': {'name': 'COS - First Mile/Last Mile', 'category': 'Other Cost Of Sales', 'type': 'COGS'},
-    '51913': {'name': 'COS - Teleportal', 'category': 'Other Cost Of Sales', 'type': 'COGS'},
-    '51942': {'name': 'Online Advertising Cost', 'category': 'Other Cost Of Sales', 'type': 'COGS'},
-    '51966': {'name': 'Point of Issuing Cost', 'category': 'Other Cost Of Sales', 'type': 'COGS'},
+# Parsed uploads kept between reruns; least recently used entries are evicted beyond this
+LEDGER_CACHE_ENTRIES = 4
+
+@st.cache_data(max_entries=LEDGER_CACHE_ENTRIES, show_spinner="Loading ledger...")
+def load_ledger(file_hash, file_name, _file_bytes, sheet_name=0, compact=False, fixed_point=False):
+    """Read and enrich an upload once per file content (cache key: content hash, file name, sheet)
     
-    # Operating Expenses - Direct Payroll
-    '51211': {'name': 'Basic Salary', 'category': 'Direct Payroll', 'type': 'OPEX'},
-    '51215': {'name': 'Allowance - Others', 'category': 'Direct Payroll', 'type': 'OPEX'},
-    '51218': {'name': 'Provident Fund - Employer', 'category': 'Direct Payroll', 'type': 'OPEX'},
-    '51219': {'name': 'Social Security Fund - Employer', 'category': 'Direct Payroll', 'type': 'OPEX'},
-    '51251': {'name': 'Human Resource Development Fund (HRDF)', 'category': 'Direct Payroll', 'type': 'OPEX'},
-    '51257': {'name': 'Accommodation - Hotels', 'category': 'Direct Payroll', 'type': 'OPEX'},
+    Returns (df, unknown_codes, period_index); period_index is None without a time dimension.
+    """
+    df, unknown_codes, has_time_dimension = prepare_ledger(read_ledger(_file_bytes, file_name, sheet_name), fixed_point)
+    if compact:
+        df = compact_ledger(df)
+    if not has_time_dimension:
+        return df, unknown_codes, None
+    df, period_index = index_periods(df)
+    return df, unknown_codes, period_index
+
+@st.cache_data(max_entries=LEDGER_CACHE_ENTRIES, show_spinner=False)
+def list_excel_sheets(file_hash, _file_bytes):
+    """Cached worksheet names for the sheet selector"""
+    return excel_sheet_names(_file_bytes, fastest_excel_engine())
+
+@st.cache_data(max_entries=LEDGER_CACHE_ENTRIES, show_spinner="Streaming ledger...")
+def load_ledger_streaming(file_hash, spill_detail, _file_bytes, compact=False, fixed_point=False):
+    """Streaming counterpart of load_ledger for CSV uploads"""
+    spill_path = detail_spill_path(file_hash) if spill_detail else None
+    df, unknown_codes, has_time_dimension = stream_csv_ledger(io.BytesIO(_file_bytes), spill_path=spill_path,
+                                                              fixed_point=fixed_point)
+    if compact:
+        df = compact_ledger(df)
+    if not has_time_dimension:
+        return df, unknown_codes, None
+    df, period_index = index_periods(df)
+    return df, unknown_codes, period_index
+
+def read_detail_spill(file_hash):
+    """Contents of a streamed upload's line-level spill file, closing it once read"""
+    with open(detail_spill_path(file_hash), 'rb') as f:
+        return f.read()
+
+@st.cache_data(max_entries=LEDGER_CACHE_ENTRIES, show_spinner="Loading from ledger store...")
+def load_store_ledger(store_path, entity, start, end, fingerprint, compact=False, fixed_point=False):
+    """Cached ledger store load; the fingerprint invalidates it when partitions change"""
+    df = load_ledger_store(store_path, [entity], start, end)
+    if fixed_point:
+        df['amount'] = to_minor_units(df['amount'])
+        df = with_amount_scale(df, AMOUNT_SCALE)
+    if compact:
+        df = compact_ledger(df)
+    df, period_index = index_periods(df)
+    return df, [], period_index
+
+@st.cache_data(max_entries=LEDGER_CACHE_ENTRIES, show_spinner="Loading stored history...")
+def load_history(store_path, entity, fingerprint):
+    """Cached aggregate history for an entity: (GL-level ledger, period_index, period metrics)"""
+    df, period_index = index_periods(load_period_aggregates(store_path, entity))
+    return df, period_index, load_period_metrics(store_path, entity)
+
+@st.cache_data(max_entries=LEDGER_CACHE_ENTRIES, show_spinner="Consolidating entity ledgers...")
+def load_group(group_key, eliminate, _ledgers, compact=False, fixed_point=False):
+    """Aggregate entity uploads in parallel and eliminate intercompany codes (cache key: entity content hashes)
     
-    # Operating Expenses - Indirect Payroll
-    '61111': {'name': 'Basic Salary', 'category': 'Indirect Payroll', 'type': 'OPEX'},
-    '61113': {'name': 'Bonus', 'category': 'Indirect Payroll', 'type': 'OPEX'},
-    '61114': {'name': 'Allowance', 'category': 'Indirect Payroll', 'type': 'OPEX'},
-    '61116': {'name': 'Medical Expenses', 'category': 'Indirect Payroll', 'type': 'OPEX'},
-    '61117': {'name': 'Provident Fund - Employer', 'category': 'Indirect Payroll', 'type': 'OPEX'},
-    '61118': {'name': 'Social Security Fund - Employer', 'category': 'Indirect Payroll', 'type': 'OPEX'},
-    '61149': {'name': 'Other Payroll Cost', 'category': 'Indirect Payroll', 'type': 'OPEX'},
-    '61151': {'name': 'Human Resource Development Fund (HRDF)', 'category': 'Indirect Payroll', 'type': 'OPEX'},
-    '61152': {'name': 'Housing Fund Contribution', 'category': 'Indirect Payroll', 'type': 'OPEX'},
-    '61153': {'name': 'Training', 'category': 'Indirect Payroll', 'type': 'OPEX'},
-    '61154': {'name': 'Uniform & Accessories', 'category': 'Indirect Payroll', 'type': 'OPEX'},
-    '61155': {'name': 'Travelling - Air Ticket / Other Transport', 'category': 'Indirect Payroll', 'type': 'OPEX'},
-    '61156': {'name': 'Travelling - Others', 'category': 'Indirect Payroll', 'type': 'OPEX'},
-    '61157': {'name': 'Accommodation', 'category': 'Indirect Payroll', 'type': 'OPEX'},
-    '61160': {'name': 'Recruitment Expenses', 'category': 'Indirect Payroll', 'type': 'OPEX'},
-    '61189': {'name': 'Other Personnel Cost', 'category': 'Indirect Payroll', 'type': 'OPEX'},
+    Returns (consolidated df, unknown_codes, period_index, eliminated rows); period_index is None
+    without a time dimension.
+    """
+    results = aggregate_entities(_ledgers, fixed_point=fixed_point)
+    group = combine_entities({entity: aggregates for entity, (aggregates, _) in results.items()})
+    df, eliminated = eliminate_intercompany(group, eliminate)
+    if compact:
+        df = compact_ledger(df)
+    if 'year_month' not in df.columns:
+        return df, unknown_entity_codes(results), None, eliminated
+    df, period_index = index_periods(df)
+    return df, unknown_entity_codes(results), period_index, eliminated
+
+@st.cache_data(max_entries=LEDGER_CACHE_ENTRIES, show_spinner=False)
+def detail_sort_order(view_key, _df):
+    """Row positions of a ledger view by descending amount, sorted once per view (ledger + periods)"""
+    return np.argsort(-_df['amount'].to_numpy(), kind='stable')
+
+@st.cache_data(max_entries=LEDGER_CACHE_ENTRIES, show_spinner=False)
+def detail_gl_index(view_key, _df):
+    """GL code -> row positions index of a ledger view, built once per view for the search box"""
+    return index_gl_rows(_df['gl_code'])
+
+# Detailed Data page sizes (rows rendered per page)
+DETAIL_PAGE_SIZES = [100, 500, 1000, 5000]
+
+# Chart builders; each draws one figure from a view's pre-aggregated chart data
+def trend_performance_figure(trend_df):
+    """Revenue and profit lines over the trend periods"""
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=trend_df['Period'], y=trend_df['Revenue'], 
+                             mode='lines+markers', name='Revenue', line=dict(width=3)))
+    fig.add_trace(go.Scatter(x=trend_df['Period'], y=trend_df['Gross Profit'], 
+                             mode='lines+markers', name='Gross Profit'))
+    fig.add_trace(go.Scatter(x=trend_df['Period'], y=trend_df['EBITDA'], 
+                             mode='lines+markers', name='EBITDA'))
+    fig.add_trace(go.Scatter(x=trend_df['Period'], y=trend_df['EBIT'], 
+                             mode='lines+markers', name='EBIT'))
+    fig.update_layout(height=500, title="Financial Performance Over Time",
+                      yaxis_title="Amount ($)", xaxis_title="Period")
+    return fig
+
+def trend_margin_figure(trend_df):
+    """Margin lines over the trend periods"""
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=trend_df['Period'], y=trend_df['Gross Margin %'], 
+                             mode='lines+markers', name='Gross Margin', line=dict(width=3)))
+    fig.add_trace(go.Scatter(x=trend_df['Period'], y=trend_df['EBITDA Margin %'], 
+                             mode='lines+markers', name='EBITDA Margin'))
+    fig.add_trace(go.Scatter(x=trend_df['Period'], y=trend_df['EBIT Margin %'], 
+                             mode='lines+markers', name='EBIT Margin'))
+    fig.update_layout(height=500, title="Margin Performance Over Time",
+                      yaxis_title="Margin (%)", xaxis_title="Period")
+    return fig
+
+def mom_growth_figure(growth_df):
+    """Month-over-month revenue and EBITDA growth bars (growth_df: trend_frame of metric_growth)"""
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=growth_df['Period'], y=growth_df['Revenue'], 
+                         name='Revenue Growth %', marker_color='lightblue'))
+    fig.add_trace(go.Bar(x=growth_df['Period'], y=growth_df['EBITDA'], 
+                         name='EBITDA Growth %', marker_color='lightgreen'))
+    fig.update_layout(height=400, title="Month-over-Month Growth Rates",
+                      yaxis_title="Growth (%)", barmode='group')
+    return fig
+
+def waterfall_figure(metrics):
+    """P&L waterfall from revenue to pre-tax profit"""
+    waterfall_data = {
+        'Metric': ['Revenue', 'COGS', 'Gross Profit', 'OPEX', 'EBITDA', 'D&A', 'EBIT', 'Interest', 'Non-Op', 'PBT'],
+        'Amount': [
+            metrics['total_revenue'],
+            -metrics['total_cogs'],
+            metrics['gross_profit'],
+            -metrics['total_opex'],
+            metrics['ebitda'],
+            -metrics['total_da'],
+            metrics['ebit'],
+            metrics['net_interest'],
+            metrics['non_operating'],
+            metrics['pbt']
+        ]
+    }
     
-    # Marketing & Advertising
-    '61211': {'name': 'Advertising - Outdoor', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
-    '61213': {'name': 'Advertising - Radio', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
-    '61215': {'name': 'Advertising - Internet', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
-    '61218': {'name': 'Point Of Display', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
-    '61219': {'name': 'Design/Production', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
-    '61220': {'name': 'Events and Fairs', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
-    '61221': {'name': 'Gift - General', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
-    '61223': {'name': 'Sponsorship', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
-    '61226': {'name': 'Special Projects', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
-    '61227': {'name': 'Photography', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
-    '61228': {'name': 'License Fee', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
-    '61229': {'name': 'Web Transaction Fees', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
-    '61230': {'name': 'Communication Materials', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
-    '61232': {'name': 'Merchandise Consumption', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
-    '61233': {'name': 'Loyalty Cost', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
-    '61237': {'name': 'Regional Special Project', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
-    '61239': {'name': 'Advertising - Always On Digital (MKT)', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
-    '61240': {'name': 'Marketing Incentive', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
-    '61241': {'name': 'Partnership Funds Spending', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
-    '61249': {'name': 'Other Advertising Cost', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    fig = go.Figure(go.Waterfall(
+        name="P&L Waterfall",
+        orientation="v",
+        measure=["absolute", "relative", "total", "relative", "total", "relative", "total", "relative", "relative", "total"],
+        x=waterfall_data['Metric'],
+        y=waterfall_data['Amount'],
+        text=[f"${v:,.0f}" for v in waterfall_data['Amount']],
+        textposition="outside",
+        connector={"line": {"color": "rgb(63, 63, 63)"}},
+        decreasing={"marker": {"color": "#EF5350"}},
+        increasing={"marker": {"color": "#66BB6A"}},
+        totals={"marker": {"color": "#42A5F5"}}
+    ))
     
-    # Insurance & Fees
-    '61311': {'name': 'Group Hospitalisation', 'category': 'Insurance', 'type': 'OPEX'},
-    '61312': {'name': 'Group Term Life', 'category': 'Insurance', 'type': 'OPEX'},
-    '61313': {'name': 'Group Personal Accident', 'category': 'Insurance', 'type': 'OPEX'},
-    '61349': {'name': 'Other Insurance Cost', 'category': 'Insurance', 'type': 'OPEX'},
-    '61411': {'name': 'Management Fees', 'category': 'Professional Fees', 'type': 'OPEX'},
-    '61412': {'name': 'Audit Fees', 'category': 'Professional Fees', 'type': 'OPEX'},
-    '61413': {'name': 'Professional Fees', 'category': 'Professional Fees', 'type': 'OPEX'},
-    '61415': {'name': 'Secretarial Fees', 'category': 'Professional Fees', 'type': 'OPEX'},
-    '61419': {'name': 'Consultant Fees', 'category': 'Professional Fees', 'type': 'OPEX'},
-    '61420': {'name': 'Stamping Fees', 'category': 'Professional Fees', 'type': 'OPEX'},
-    '61421': {'name': 'Tax Fees', 'category': 'Professional Fees', 'type': 'OPEX'},
-    '61422': {'name': 'Fines / Penalties', 'category': 'Professional Fees', 'type': 'OPEX'},
-    '61423': {'name': 'Brand License Cost', 'category': 'Professional Fees', 'type': 'OPEX'},
-    '61425': {'name': 'AASEA Service Cost', 'category': 'Professional Fees', 'type': 'OPEX'},
-    '61426': {'name': 'ICT Shared Service Cost', 'category': 'Professional Fees', 'type': 'OPEX'},
-    '61449': {'name': 'Other Fees', 'category': 'Professional Fees', 'type': 'OPEX'},
+    fig.update_layout(
+        title="P&L Waterfall: Revenue to Pre-Tax Profit",
+        height=600,
+        showlegend=False,
+        yaxis_title="Amount ($)"
+    )
+    return fig
+
+def budget_variance_figure(metric_var):
+    """Bridge from budget PBT to actual PBT through each P&L line's variance"""
+    bridge = variance_bridge(metric_var)
+    amounts = [metric_var.at['pbt', 'budget']] + bridge.tolist() + [metric_var.at['pbt', 'actual']]
     
-    # General & Administrative
-    '61511': {'name': 'Printing', 'category': 'General & Administrative', 'type': 'OPEX'},
-    '61512': {'name': 'Stationeries and Office Supplies', 'category': 'General & Administrative', 'type': 'OPEX'},
-    '61513': {'name': 'Telephone and Faxes', 'category': 'General & Administrative', 'type': 'OPEX'},
-    '61514': {'name': 'Utility', 'category': 'General & Administrative', 'type': 'OPEX'},
-    '61515': {'name': 'Postage & Courier', 'category': 'General & Administrative', 'type': 'OPEX'},
-    '61516': {'name': 'Entertainment - Staff', 'category': 'General & Administrative', 'type': 'OPEX'},
-    '61517': {'name': 'Entertainment - Business', 'category': 'General & Administrative', 'type': 'OPEX'},
-    '61522': {'name': 'Rental - Warehouse', 'category': 'General & Administrative', 'type': 'OPEX'},
-    '61526': {'name': 'Maintainance - Others', 'category': 'General & Administrative', 'type': 'OPEX'},
-    '61527': {'name': 'Refreshments', 'category': 'General & Administrative', 'type': 'OPEX'},
-    '61532': {'name': 'Staff Welfare', 'category': 'General & Administrative', 'type': 'OPEX'},
-    '61535': {'name': 'Maintenance - Office Equipment', 'category': 'General & Administrative', 'type': 'OPEX'},
-    '61549': {'name': 'Other Office Expenses', 'category': 'General & Administrative', 'type': 'OPEX'},
-    '61552': {'name': 'Communication Service - Internet Access Fee', 'category': 'IT Expenses', 'type': 'OPEX'},
-    '61554': {'name': 'Hosted System', 'category': 'IT Expenses', 'type': 'OPEX'},
-    '61556': {'name': 'Maintenance - Computer Software', 'category': 'IT Expenses', 'type': 'OPEX'},
-    '61557': {'name': 'License Fee - Computer Software', 'category': 'IT Expenses', 'type': 'OPEX'},
-    '61558': {'name': 'Web Services', 'category': 'IT Expenses', 'type': 'OPEX'},
-    '61569': {'name': 'Other IT Expenses', 'category': 'IT Expenses', 'type': 'OPEX'},
+    fig = go.Figure(go.Waterfall(
+        name="Budget Variance",
+        orientation="v",
+        measure=["absolute"] + ["relative"] * len(bridge) + ["total"],
+        x=['Budget PBT'] + bridge.index.tolist() + ['Actual PBT'],
+        y=amounts,
+        text=[f"${v:,.0f}" for v in amounts],
+        textposition="outside",
+        connector={"line": {"color": "rgb(63, 63, 63)"}},
+        decreasing={"marker": {"color": "#EF5350"}},
+        increasing={"marker": {"color": "#66BB6A"}},
+        totals={"marker": {"color": "#42A5F5"}}
+    ))
     
-    # Other Operating Expenses
-    '61713': {'name': 'FA Expensed Off', 'category': 'Other Operating Expenses', 'type': 'OPEX'},
-    '61714': {'name': 'Provision for Doubtful Debts', 'category': 'Other Operating Expenses', 'type': 'OPEX'},
-    '61716': {'name': 'Provision for Impairment PPE', 'category': 'Other Operating Expenses', 'type': 'OPEX'},
-    '61720': {'name': 'AEP Expenses', 'category': 'Other Operating Expenses', 'type': 'OPEX'},
-    '61724': {'name': 'Rounding Account', 'category': 'Other Operating Expenses', 'type': 'OPEX'},
-    '61727': {'name': 'Bad Debts Written Off', 'category': 'Other Operating Expenses', 'type': 'OPEX'},
-    '61725': {'name': 'Imported Service Tax Expense', 'category': 'Other Operating Expenses', 'type': 'OPEX'},
-    '617A6': {'name': 'Provision for Impairment of Investment', 'category': 'Other Operating Expenses', 'type': 'OPEX'},
+    fig.update_layout(
+        title="Variance Bridge: Budget to Actual Pre-Tax Profit",
+        height=550,
+        showlegend=False,
+        yaxis_title="Amount ($)"
+    )
+    return fig
+
+def margin_progression_figure(metrics):
+    """Margin at each P&L stage"""
+    margin_df = pd.DataFrame({
+        'Stage': ['Gross Margin', 'EBITDA Margin', 'EBIT Margin', 'PBT Margin'],
+        'Margin %': [metrics['gross_margin'], metrics['ebitda_margin'], 
+                   metrics['ebit_margin'], metrics['pbt_margin']]
+    })
     
-    # Depreciation & Amortization
-    '61629': {'name': 'Depreciation - Computer Hardware', 'category': 'Depreciation & Amortization', 'type': 'D&A'},
-    '61630': {'name': 'Depreciation - Computer Software', 'category': 'Depreciation & Amortization', 'type': 'D&A'},
-    '61685': {'name': 'Amortisation - Intangibles', 'category': 'Depreciation & Amortization', 'type': 'D&A'},
+    fig = px.bar(margin_df, x='Stage', y='Margin %', 
+                 color='Margin %',
+                 color_continuous_scale='RdYlGn',
+                 text='Margin %')
+    fig.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
+    fig.update_layout(height=400, showlegend=False)
+    return fig
+
+def revenue_mix_figure(totals):
+    """Revenue distribution pie over revenue categories"""
+    revenue_by_cat = type_totals(totals, ['Revenue']).droplevel('type').sort_values(ascending=False)
+    fig = px.pie(values=revenue_by_cat.values, 
+                 names=revenue_by_cat.index,
+                 title="Revenue Distribution")
+    fig.update_traces(textposition='inside', textinfo='percent+label')
+    return fig
+
+def cost_structure_figure(totals):
+    """Treemap of COGS/OPEX categories"""
+    cost_tree_df = type_totals(totals, ['COGS', 'OPEX']).abs().reset_index()
+    cost_tree_df.columns = ['Type', 'Category', 'Amount']
     
-    # Interest & Financial
-    '71111': {'name': 'Interest Income - Bank Interest', 'category': 'Interest Income', 'type': 'Interest'},
-    '71121': {'name': 'Term Loan Interest', 'category': 'Interest Expense', 'type': 'Interest'},
-    '71130': {'name': 'Lease Interest - IFRS 16', 'category': 'Interest Expense', 'type': 'Interest'},
-    '71141': {'name': 'Bank Charges', 'category': 'Financial Charges', 'type': 'Interest'},
-    '71142': {'name': 'Bank Guarantee Charges', 'category': 'Financial Charges', 'type': 'Interest'},
-    '71149': {'name': 'Other Financial Charges', 'category': 'Financial Charges', 'type': 'Interest'},
+    fig = px.treemap(cost_tree_df, 
+                     path=['Type', 'Category'], 
+                     values='Amount',
+                     title='Cost Structure Hierarchy',
+                     color='Amount',
+                     color_continuous_scale='Reds')
+    fig.update_layout(height=600)
+    return fig
+
+def cost_matrix_figure(totals):
+    """Top 10 cost categories by absolute amount"""
+    # Each category belongs to one account type, so the type level drops without regrouping
+    cost_summary = type_totals(totals, ['COGS', 'OPEX']).droplevel('type').abs().reset_index()
+    cost_summary['% of Total Cost'] = safe_ratio(cost_summary['amount'], cost_summary['amount'].sum())
+    cost_summary = cost_summary.sort_values('amount', ascending=False).head(10)
     
-    # Non-Operating
-    '81111': {'name': 'FOREX - Realised Gain /(Loss)', 'category': 'Forex', 'type': 'Non-Operating'},
-    '81121': {'name': 'FOREX - Unrealised Gain/(Loss)', 'category': 'Forex', 'type': 'Non-Operating'},
+    fig = px.bar(cost_summary, 
+                 x='category', 
+                 y='amount',
+                 text='amount',
+                 title='Top 10 Cost Categories',
+                 labels={'amount': 'Cost ($)', 'category': 'Category'})
+    fig.update_traces(texttemplate='$%{text:,.0f}', textposition='outside')
+    fig.update_layout(height=500, xaxis_tickangle=-45)
+    return fig
+
+def entity_pnl_figure(entity_table):
+    """Revenue, EBITDA and PBT per entity next to the consolidated group"""
+    fig = go.Figure()
+    for metric, label in [('total_revenue', 'Revenue'), ('ebitda', 'EBITDA'), ('pbt', 'PBT')]:
+        fig.add_trace(go.Bar(x=entity_table.index, y=entity_table[metric], name=label))
+    fig.update_layout(height=450, title="Entity P&L vs Group", yaxis_title="Amount ($)", barmode='group')
+    return fig
+
+CHART_BUILDERS = {
+    'trend_performance': trend_performance_figure,
+    'trend_margins': trend_margin_figure,
+    'mom_growth': mom_growth_figure,
+    'waterfall': waterfall_figure,
+    'budget_variance': budget_variance_figure,
+    'margin_progression': margin_progression_figure,
+    'revenue_mix': revenue_mix_figure,
+    'cost_structure': cost_structure_figure,
+    'cost_matrix': cost_matrix_figure,
+    'entity_pnl': entity_pnl_figure,
 }
 
-def calculate_metrics(df):
-    """Calculate key financial metrics"""
-    metrics = {}
-    
-    # Total Revenue
-    revenue_df = df[df['type'] == 'Revenue']
-    metrics['total_revenue'] = revenue_df['amount'].sum()
-    
-    # COGS
-    cogs_df = df[df['type'] == 'COGS']
-    metrics['total_cogs'] = abs(cogs_df['amount'].sum())
-    
-    # Gross Profit
-    metrics['gross_profit'] = metrics['total_revenue'] - metrics['total_cogs']
-    metrics['gross_margin'] = (metrics['gross_profit'] / metrics['total_revenue'] * 100) if metrics['total_revenue'] != 0 else 0
-    
-    # OPEX
-    opex_df = df[df['type'] == 'OPEX']
-    metrics['total_opex'] = abs(opex_df['amount'].sum())
-    
-    # EBITDA
-    metrics['ebitda'] = metrics['gross_profit'] - metrics['total_opex']
-    metrics['ebitda_margin'] = (metrics['ebitda'] / metrics['total_revenue'] * 100) if metrics['total_revenue'] != 0 else 0
-    
-    # D&A
-    da_df = df[df['type'] == 'D&A']
-    metrics['total_da'] = abs(da_df['amount'].sum())
-    
-    # EBIT
-    metrics['ebit'] = metrics['ebitda'] - metrics['total_da']
-    metrics['ebit_margin'] = (metrics['ebit'] / metrics['total_revenue'] * 100) if metrics['total_revenue'] != 0 else 0
-    
-    # Interest
-    interest_df = df[df['type'] == 'Interest']
-    interest_income = interest_df[interest_df['category'] == 'Interest Income']['amount'].sum()
-    interest_expense = abs(interest_df[interest_df['category'] != 'Interest Income']['amount'].sum())
-    metrics['net_interest'] = interest_income - interest_expense
-    
-    # Non-Operating
-    nonop_df = df[df['type'] == 'Non-Operating']
-    metrics['non_operating'] = nonop_df['amount'].sum()
-    
-    # PBT
-    metrics['pbt'] = metrics['ebit'] + metrics['net_interest'] + metrics['non_operating']
-    metrics['pbt_margin'] = (metrics['pbt'] / metrics['total_revenue'] * 100) if metrics['total_revenue'] != 0 else 0
-    
-    return metrics
+# Cached figures kept across reruns (a view has up to len(CHART_BUILDERS) of them)
+FIGURE_CACHE_ENTRIES = 64
 
-def generate_optimization_recommendations(df, metrics):
-    """Generate AI-driven optimization recommendations based on investment banking principles"""
-    recommendations = []
-    
-    # 1. Margin Analysis
-    if metrics['gross_margin'] < 40:
-        recommendations.append({
-            'priority': 'High',
-            'category': 'Gross Margin',
-            'issue': f"Gross margin at {metrics['gross_margin']:.1f}% is below industry benchmark (40-50% for airlines)",
-            'action': 'Review pricing strategy and negotiate supplier contracts for inflight products',
-            'impact': 'Potential 3-5% margin improvement could add $' + f"{(metrics['total_revenue'] * 0.04):,.0f}" + ' to bottom line'
-        })
-    
-    # 2. COGS Efficiency
-    cogs_categories = df[df['type'] == 'COGS'].groupby('category')['amount'].sum().abs()
-    if len(cogs_categories) > 0:
-        top_cogs = cogs_categories.nlargest(3)
-        for cat, amt in top_cogs.items():
-            cogs_pct = (amt / metrics['total_cogs']) * 100
-            if cogs_pct > 25:
-                recommendations.append({
-                    'priority': 'High',
-                    'category': 'COGS Optimization',
-                    'issue': f"{cat} represents {cogs_pct:.1f}% of total COGS (${amt:,.0f})",
-                    'action': f'Benchmark {cat} against competitors and negotiate volume discounts',
-                    'impact': f'10% reduction could save ${amt * 0.10:,.0f} annually'
-                })
-    
-    # 3. Marketing ROI
-    marketing_spend = abs(df[df['category'] == 'Marketing & Advertising']['amount'].sum())
-    if marketing_spend > 0:
-        marketing_pct = (marketing_spend / metrics['total_revenue']) * 100
-        if marketing_pct > 8:
-            recommendations.append({
-                'priority': 'Medium',
-                'category': 'Marketing Efficiency',
-                'issue': f"Marketing spend at {marketing_pct:.1f}% of revenue (${marketing_spend:,.0f}) exceeds benchmark (5-7%)",
-                'action': 'Implement digital marketing attribution model and shift to performance-based channels',
-                'impact': f'Optimizing to 6% could save ${(marketing_spend - metrics['total_revenue'] * 0.06):,.0f}'
-            })
-    
-    # 4. Revenue Diversification
-    revenue_by_category = df[df['type'] == 'Revenue'].groupby('category')['amount'].sum()
-    if len(revenue_by_category) > 0:
-        flight_rev = revenue_by_category.get('Flight Revenue', 0)
-        flight_pct = (flight_rev / metrics['total_revenue']) * 100
-        if flight_pct > 80:
-            recommendations.append({
-                'priority': 'Medium',
-                'category': 'Revenue Diversification',
-                'issue': f"Flight revenue represents {flight_pct:.1f}% of total - high concentration risk",
-                'action': 'Develop ancillary revenue streams: baggage fees, seat selection, inflight sales, partnerships',
-                'impact': 'Ancillary revenue can add 15-20% to total revenue per industry standards'
-            })
+@st.cache_resource(max_entries=LEDGER_CACHE_ENTRIES, show_spinner=False)
+def ledger_rollup(ledger_key, _df):
+    """Rollup cube of a whole ledger (all periods), built once per dataset; views read slices of it
     
-    # 5. Personnel Cost Analysis
-    payroll_costs = abs(df[df['category'].str.contains('Payroll', na=False)]['amount'].sum())
-    if payroll_costs > 0:
-        payroll_pct = (payroll_costs / metrics['total_revenue']) * 100
-        if payroll_pct > 30:
-            recommendations.append({
-                'priority': 'Medium',
-                'category': 'Labor Productivity',
-                'issue': f"Personnel costs at {payroll_pct:.1f}% of revenue (${payroll_costs:,.0f}) above benchmark (25-28%)",
-                'action': 'Review headcount efficiency, automate processes, and optimize crew scheduling',
-                'impact': f'2% improvement could save ${payroll_costs * 0.02:,.0f}'
-            })
-    
-    # 6. Technology & Digital Transformation
-    it_spend = abs(df[df['category'] == 'IT Expenses']['amount'].sum())
-    if it_spend > 0:
-        it_pct = (it_spend / metrics['total_revenue']) * 100
-        if it_pct < 2:
-            recommendations.append({
-                'priority': 'Low',
-                'category': 'Digital Investment',
-                'issue': f"IT spend at {it_pct:.1f}% of revenue (${it_spend:,.0f}) below benchmark (3-5%)",
-                'action': 'Increase investment in digital booking platforms, mobile apps, and data analytics',
-                'impact': 'Digital transformation can improve customer experience and reduce distribution costs'
-            })
-    
-    # 7. Commission & Distribution Costs
-    commission_items = df[df['name'].str.contains('Commission|Gateway|Merchant', case=False, na=False)]
-    total_commission = abs(commission_items['amount'].sum())
-    if total_commission > 0:
-        comm_pct = (total_commission / metrics['total_revenue']) * 100
-        if comm_pct > 5:
-            recommendations.append({
-                'priority': 'High',
-                'category': 'Distribution Cost',
-                'issue': f"Commission & payment fees at {comm_pct:.1f}% of revenue (${total_commission:,.0f})",
-                'action': 'Shift to direct booking channels, renegotiate credit card fees, and optimize payment mix',
-                'impact': f'1% reduction could save ${metrics['total_revenue'] * 0.01:,.0f}'
-            })
-    
-    # 8. EBITDA Optimization
-    if metrics['ebitda_margin'] < 15:
-        recommendations.append({
-            'priority': 'Critical',
-            'category': 'Overall Profitability',
-            'issue': f"EBITDA margin at {metrics['ebitda_margin']:.1f}% below healthy airline benchmark (15-20%)",
-            'action': 'Implement comprehensive margin enhancement program across all cost categories',
-            'impact': 'Target 18% EBITDA margin for sustainable operations and growth investment'
-        })
+    Held as a shared object rather than a pickled copy, so a rerun pays neither the groupby
+    nor an unpickle; callers only slice it, never modify it.
+    """
+    return rollup_cube(_df)
+
+def drill_down_table(cube, category, periods=None, signed=False):
+    """Formatted GL codes of one category with their share of the category total"""
+    items = view_gl_totals(cube, periods, category=category)
+    items = items.iloc[np.argsort(-items['amount'].abs().to_numpy(), kind='stable')]
+    share = safe_ratio(items['amount'], items['amount'].sum())
+    return pd.DataFrame({
+        'GL Code': items.index.astype(str),
+        'Account': items['name'].to_numpy(),
+        'Amount': (items['amount'] if signed else items['amount'].abs()).apply(lambda x: f"${x:,.0f}").to_numpy(),
+        '% of Category': share.apply(lambda x: "n/a" if pd.isna(x) else f"{x:.1f}%").to_numpy(),
+    })
+
+# Line-item table views: rank_totals arguments per choice
+LINE_ITEM_VIEWS = {
+    'Top 10': {'n': 10},
+    'Bottom 10': {'n': 10, 'bottom': True},
+    'Pareto (80%)': {'pareto': 0.8},
+}
+
+def line_item_table(gl_totals, types, view, signed=False):
+    """Formatted GL line items of the given types for a LINE_ITEM_VIEWS choice"""
+    items = gl_totals[gl_totals['type'].isin(types)]
+    ranked = rank_totals(items, signed=signed, **LINE_ITEM_VIEWS[view])[['name', 'amount', 'category']]
+    amounts = ranked['amount'] if signed else ranked['amount'].abs()
+    return ranked.assign(amount=amounts.apply(lambda x: f"${x:,.0f}"))
+
+@st.cache_resource(max_entries=FIGURE_CACHE_ENTRIES, show_spinner=False)
+def chart_figure(view_key, chart, _data):
+    """Figure for one chart of a ledger view, built once per (view, chart) and reused on reruns
     
-    return sorted(recommendations, key=lambda x: {'Critical': 0, 'High': 1, 'Medium': 2, 'Low': 3}[x['priority']])
+    The cached Figure object itself is returned (no pickle round trip); st.plotly_chart copies
+    it before serialising, so the shared object is never mutated.
+    """
+    return CHART_BUILDERS[chart](_data)
+
+def format_variance(variance, percent_points=None):
+    """Format a variance_frame for display; rows in percent_points are margins shown in %/pp"""
+    percent_points = variance.index.isin(percent_points or [])
+    money = lambda x: f"${x:,.0f}"
+    return pd.DataFrame({
+        'Actual': [f"{a:.1f}%" if pp else money(a) for a, pp in zip(variance['actual'], percent_points)],
+        'Budget': [f"{b:.1f}%" if pp else money(b) for b, pp in zip(variance['budget'], percent_points)],
+        'Variance': [f"{v:+.1f} pp" if pp else f"{v:+,.0f}" for v, pp in zip(variance['variance'], percent_points)],
+        'Variance %': variance['variance_pct'].apply(lambda x: "n/a" if pd.isna(x) else f"{x:+.1f}%").to_numpy(),
+    }, index=variance.index)
+
+# Headline card bases: the period(s) in view, or a METRIC_WINDOWS basis as of the latest one
+HEADLINE_BASES = ["Period in view"] + [basis for basis in METRIC_WINDOWS if basis != 'Month']
+
+def trend_frame(metrics_by_period):
+    """TREND_COLUMNS of a per-period metrics frame with a Period column, as the trend charts expect"""
+    return (metrics_by_period[list(TREND_COLUMNS)]
+            .rename(columns=TREND_COLUMNS)
+            .rename_axis('Period')
+            .reset_index())
+
+def format_trend(trend_df, growth=False):
+    """Formatted trend table: amounts in $ and margins in %, or growth % and margin pp changes"""
+    formatted = trend_df.copy()
+    amount_format, margin_format = ("{:+.1f}%", "{:+.1f} pp") if growth else ("${:,.0f}", "{:.1f}%")
+    for col in ['Revenue', 'Gross Profit', 'EBITDA', 'EBIT', 'PBT']:
+        formatted[col] = formatted[col].apply(lambda x: "n/a" if pd.isna(x) else amount_format.format(x))
+    for col in ['Gross Margin %', 'EBITDA Margin %', 'EBIT Margin %']:
+        formatted[col] = formatted[col].apply(lambda x: "n/a" if pd.isna(x) else margin_format.format(x))
+    return formatted
+
+def tab_is_open(tab, lazy):
+    """Whether to build a tab's content: always, or only while it is the open tab when lazy"""
+    return not lazy or tab.open is not False
 
 # App Title
 st.title("✈️ Airline P&L Profitability Analyzer")
@@ -340,12 +441,48 @@ with st.sidebar:
     st.markdown("Upload your P&L data with GL codes and amounts")
     
     uploaded_file = st.file_uploader("Choose CSV or Excel file", type=['csv', 'xlsx', 'xls'])
+    stream_mode = st.checkbox("Streaming mode (large CSV files)",
+                              help="Read the CSV in chunks and keep only per-period GL totals in memory")
+    spill_detail = st.checkbox("Keep line-level detail on disk", disabled=not stream_mode)
+    compact_mode = st.checkbox("Compact memory mode",
+                               help="float32 amounts, categorical keys and no source-only columns")
+    fixed_point = st.checkbox("Exact amounts (fixed-point cents)",
+                              help="Parse amounts into integer cents so totals reconcile exactly")
+    lazy_tabs = st.checkbox("Build only the open tab",
+                            help="Render tab contents and charts only when their tab is selected")
+    
+    st.markdown("---")
+    st.markdown("### 💾 Ledger Store")
+    store_path = st.text_input("Store directory", value=DEFAULT_STORE_PATH)
+    store_entity = None
+    store_entities = list_entities(store_path)
+    if uploaded_file is None and store_entities:
+        store_entity = st.selectbox("Open stored entity", ["—"] + store_entities)
+        store_entity = None if store_entity == "—" else store_entity
+        if store_entity:
+            stored_periods = list_periods(store_path, store_entity)
+            store_start, store_end = st.select_slider("Months to load", options=stored_periods,
+                                                      value=(stored_periods[0], stored_periods[-1]))
+    
+    st.markdown("---")
+    st.markdown("### 🏢 Group Consolidation")
+    entity_files = st.file_uploader("Entity ledgers (one file per entity)", type=['csv', 'xlsx', 'xls'],
+                                    accept_multiple_files=True)
+    eliminate_codes = st.multiselect("Intercompany GL codes to eliminate", list(GL_LOOKUP.index),
+                                     default=INTERCOMPANY_GL_CODES,
+                                     format_func=lambda code: f"{code} {GL_LOOKUP.at[code, 'name']}")
+    
+    st.markdown("---")
+    st.markdown("### 📐 Budget / Forecast")
+    budget_file = st.file_uploader("Budget or forecast ledger", type=['csv', 'xlsx', 'xls'],
+                                   help="Same gl_code/amount/month shape as the actuals; compared on GL code and month")
     
     st.markdown("---")
     st.markdown("### 📋 Required Columns:")
     st.markdown("- `gl_code` or `GL Code`")
     st.markdown("- `amount` or `Amount`")
     st.markdown("- `month` or `period` (optional)")
+    st.markdown("- `entity` (optional, for consolidation)")
     st.markdown("- Supports formats: 2024-01, Jan-2024, January 2024")
     
     st.markdown("---")
@@ -358,7 +495,7 @@ with st.sidebar:
     st.markdown("✓ Benchmarking Analysis")
 
 # Main Content
-if uploaded_file is None:
+if uploaded_file is None and store_entity is None and not entity_files:
     st.info("👆 Please upload your P&L data file to begin analysis")
     
     # Sample data structure
@@ -373,63 +510,109 @@ if uploaded_file is None:
 else:
     # Load data
     try:
-        if uploaded_file.name.endswith('.csv'):
-            raw_df = pd.read_csv(uploaded_file)
-        else:
-            raw_df = pd.read_excel(uploaded_file)
-        
-        # Normalize column names
-        raw_df.columns = raw_df.columns.str.lower().str.strip()
-        
-        # Check for required columns
-        if 'gl_code' not in raw_df.columns and 'gl code' not in raw_df.columns:
-            st.error("❌ File must contain 'gl_code' or 'GL Code' column")
-            st.stop()
-        
-        if 'amount' not in raw_df.columns:
-            st.error("❌ File must contain 'amount' or 'Amount' column")
+        streaming = False
+        stored_period_metrics = None
+        eliminated = None
+        peak_rss_before_load = peak_rss_bytes()
+        try:
+            if entity_files:
+                # One upload per entity (a file with an entity column keeps its own entities)
+                ledgers = {entity: (f.getvalue(), f.name)
+                           for entity, f in zip(entity_labels([f.name for f in entity_files]), entity_files)}
+                group_key = tuple((entity, hashlib.sha256(data).hexdigest()) for entity, (data, _) in ledgers.items())
+                df, unknown_codes, period_index, eliminated = load_group(group_key, sorted(eliminate_codes), ledgers,
+                                                                         compact_mode, fixed_point)
+                ledger_key = ('group', group_key, tuple(sorted(eliminate_codes)), compact_mode, fixed_point)
+                st.info(f"🏢 Consolidated **{df['entity'].nunique()} entities** "
+                        f"({len(eliminate_codes)} intercompany GL codes eliminated)")
+            elif uploaded_file is None:
+                fingerprint = store_fingerprint(store_path, store_entity)
+                df, unknown_codes, period_index = load_store_ledger(
+                    store_path, store_entity, store_start, store_end, fingerprint, compact_mode, fixed_point)
+                ledger_key = ('store', store_path, store_entity, store_start, store_end, fingerprint,
+                              compact_mode, fixed_point)
+                st.info(f"💾 Loaded **{store_entity}** from the ledger store ({store_start} to {store_end})")
+            else:
+                file_bytes = uploaded_file.getvalue()
+                file_hash = hashlib.sha256(file_bytes).hexdigest()
+                streaming = stream_mode and uploaded_file.name.endswith('.csv')
+                if streaming:
+                    df, unknown_codes, period_index = load_ledger_streaming(file_hash, spill_detail, file_bytes,
+                                                                            compact_mode, fixed_point)
+                    ledger_key = ('stream', file_hash, compact_mode, fixed_point)
+                    full_precision = lambda: load_ledger_streaming(file_hash, spill_detail, file_bytes,
+                                                                   False, fixed_point)[0]
+                else:
+                    sheet_name = 0
+                    if not uploaded_file.name.endswith('.csv'):
+                        sheet_names = list_excel_sheets(file_hash, file_bytes)
+                        if len(sheet_names) > 1:
+                            sheet_choice = st.sidebar.selectbox("Worksheet:", sheet_names + ["All sheets (one per month)"])
+                            sheet_name = None if sheet_choice.startswith("All sheets") else sheet_choice
+                    df, unknown_codes, period_index = load_ledger(file_hash, uploaded_file.name, file_bytes, sheet_name,
+                                                                  compact_mode, fixed_point)
+                    ledger_key = ('upload', file_hash, sheet_name, compact_mode, fixed_point)
+                    full_precision = lambda: load_ledger(file_hash, uploaded_file.name, file_bytes, sheet_name,
+                                                         False, fixed_point)[0]
+                
+                # Save the enriched ledger so later sessions can skip the raw upload; compact float32
+                # amounts are an in-memory form only, so the store is written from a full-precision load
+                store_ledger = lambda: full_precision() if compact_mode else df
+                if period_index is not None:
+                    with st.sidebar:
+                        save_entity = st.text_input("Entity name", value=os.path.splitext(uploaded_file.name)[0])
+                        if st.button("Save ledger to store"):
+                            save_ledger(store_ledger(), store_path, save_entity)
+                            st.success(f"Saved {len(period_index)} months for {save_entity}")
+                        incremental = st.checkbox("Merge into stored history (incremental)",
+                                                  help="Store only this upload's monthly aggregates and analyse "
+                                                       "the entity's full history from the aggregate store")
+                        merged_before = list_aggregated_periods(store_path, save_entity)
+                        if merged_before:
+                            st.caption(f"{save_entity} history holds {len(merged_before)} merged months "
+                                       f"({merged_before[0]} to {merged_before[-1]}); merging replaces any "
+                                       f"month this upload also contains")
+                    
+                    if incremental:
+                        merged_uploads = st.session_state.setdefault('merged_uploads', set())
+                        merge_key = (file_hash, store_path, save_entity)
+                        if merge_key not in merged_uploads:
+                            merged_months = save_period_aggregates(store_ledger(), store_path, save_entity)
+                            merged_uploads.add(merge_key)
+                            replaced = [month for month in merged_months if month in merged_before]
+                            st.sidebar.success(f"Merged {', '.join(merged_months)} into {save_entity} history"
+                                               + (f" (replaced {', '.join(replaced)})" if replaced else ""))
+                        fingerprint = aggregates_fingerprint(store_path, save_entity)
+                        df, period_index, stored_period_metrics = load_history(store_path, save_entity, fingerprint)
+                        ledger_key = ('history', store_path, save_entity, fingerprint)
+            
+            budget_cube = None
+            if budget_file is not None:
+                budget_bytes = budget_file.getvalue()
+                budget_hash = hashlib.sha256(budget_bytes).hexdigest()
+                budget_df, budget_unknown, _ = load_ledger(budget_hash, budget_file.name, budget_bytes, 0,
+                                                           compact_mode, fixed_point)
+                budget_key = ('budget', budget_hash, compact_mode, fixed_point)
+                budget_cube = ledger_rollup(budget_key, budget_df)
+        except ValueError as e:
+            st.error(f"❌ {e}")
             st.stop()
-        
-        # Standardize column names
-        if 'gl code' in raw_df.columns:
-            raw_df.rename(columns={'gl code': 'gl_code'}, inplace=True)
-        
-        # Handle month/period column
-        has_time_dimension = False
-        if 'month' in raw_df.columns:
-            raw_df['period'] = pd.to_datetime(raw_df['month'], errors='coerce')
-            has_time_dimension = True
-        elif 'period' in raw_df.columns:
-            raw_df['period'] = pd.to_datetime(raw_df['period'], errors='coerce')
-            has_time_dimension = True
-        
-        if has_time_dimension:
-            raw_df = raw_df.dropna(subset=['period'])
-            raw_df['month_name'] = raw_df['period'].dt.strftime('%b %Y')
-            raw_df['year_month'] = raw_df['period'].dt.strftime('%Y-%m')
-        
-        # Convert GL codes to string
-        raw_df['gl_code'] = raw_df['gl_code'].astype(str).str.strip()
-        
-        # Map GL codes to categories
-        raw_df['name'] = raw_df['gl_code'].map(lambda x: GL_CODE_MAPPING.get(x, {}).get('name', 'Unknown'))
-        raw_df['category'] = raw_df['gl_code'].map(lambda x: GL_CODE_MAPPING.get(x, {}).get('category', 'Unknown'))
-        raw_df['type'] = raw_df['gl_code'].map(lambda x: GL_CODE_MAPPING.get(x, {}).get('type', 'Unknown'))
-        
-        # Filter out unknown codes
-        df = raw_df[raw_df['type'] != 'Unknown'].copy()
-        unknown_codes = raw_df[raw_df['type'] == 'Unknown']['gl_code'].unique()
+        peak_rss_after_load = peak_rss_bytes()
         
         if len(unknown_codes) > 0:
             st.warning(f"⚠️ {len(unknown_codes)} GL codes not recognized: {', '.join(unknown_codes[:5])}{'...' if len(unknown_codes) > 5 else ''}")
         
+        # GL hierarchy x period rollup of the whole ledger; every breakdown below reads slices of it
+        cube = ledger_rollup(ledger_key, df)
+        
         # Period/Month selector if time dimension exists
+        has_time_dimension = period_index is not None
         selected_periods = None
         if has_time_dimension:
             st.sidebar.markdown("---")
             st.sidebar.header("📅 Time Period Selection")
             
-            all_periods = sorted(df['month_name'].unique())
+            all_periods = period_index.index.tolist()
             period_selection = st.sidebar.radio(
                 "Analysis Mode:",
                 ["All Periods Combined", "Single Period", "Compare Periods", "Trend Analysis"]
@@ -438,7 +621,7 @@ else:
             if period_selection == "Single Period":
                 selected_period = st.sidebar.selectbox("Select Month:", all_periods)
                 selected_periods = [selected_period]
-                df = df[df['month_name'] == selected_period]
+                df = slice_periods(df, period_index, selected_periods)
                 st.info(f"📅 Analyzing data for: **{selected_period}**")
                 
             elif period_selection == "Compare Periods":
@@ -448,28 +631,45 @@ else:
                     default=all_periods[-2:] if len(all_periods) >= 2 else all_periods
                 )
                 if selected_periods:
-                    df = df[df['month_name'].isin(selected_periods)]
+                    df = slice_periods(df, period_index, selected_periods)
                     st.info(f"📅 Comparing: **{', '.join(selected_periods)}**")
             
             elif period_selection == "Trend Analysis":
                 st.info(f"📅 Trend analysis across **{len(all_periods)} periods**")
+            
+            headline_basis = st.sidebar.selectbox("Headline basis:", HEADLINE_BASES,
+                                                  help="Show the dashboard cards as period-to-date or rolling "
+                                                       "figures to the latest period in view")
         
         # Calculate metrics based on selection
         if has_time_dimension and period_selection in ["Compare Periods", "Trend Analysis"]:
-            metrics_by_period = {}
-            for period in df['month_name'].unique():
-                period_df = df[df['month_name'] == period]
-                metrics_by_period[period] = calculate_metrics(period_df)
+            if stored_period_metrics is not None:
+                # Incremental mode reads period metrics straight from the aggregate store
+                in_view = selected_periods if period_selection == "Compare Periods" and selected_periods else all_periods
+                metrics_by_period = stored_period_metrics.loc[[p for p in all_periods if p in in_view]]
+            else:
+                metrics_by_period = calculate_metrics_by_period(df)
             
             # Use most recent period for main metrics display
-            latest_period = sorted(df['month_name'].unique())[-1]
-            metrics = metrics_by_period[latest_period]
+            latest_period = metrics_by_period.index[-1]
+            metrics = metrics_by_period.loc[latest_period].to_dict()
         else:
             metrics = calculate_metrics(df)
         
         # Calculate metrics
         # metrics = calculate_metrics(df)
         
+        # Headline cards on a windowed basis read from the whole ledger's per-period P&L lines
+        headline = metrics
+        if has_time_dimension and headline_basis != "Period in view":
+            as_of = [p for p in all_periods if p in (selected_periods or all_periods)][-1]
+            windowed = window_metrics(rollup_lines_by_period(cube), headline_basis).loc[as_of]
+            if windowed.isna().any():
+                st.warning(f"⚠️ Not enough history for {headline_basis} to {as_of}; headline shows the period in view")
+            else:
+                headline = windowed.to_dict()
+                st.info(f"📅 Headline figures: **{headline_basis}** to {as_of}")
+        
         # Generate recommendations
         recommendations = generate_optimization_recommendations(df, metrics)
         
@@ -479,109 +679,83 @@ else:
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            st.metric("Total Revenue", f"${metrics['total_revenue']:,.0f}")
-            st.metric("Gross Profit", f"${metrics['gross_profit']:,.0f}")
+            st.metric("Total Revenue", f"${headline['total_revenue']:,.0f}")
+            st.metric("Gross Profit", f"${headline['gross_profit']:,.0f}")
         
         with col2:
-            st.metric("Gross Margin", f"{metrics['gross_margin']:.1f}%")
-            st.metric("EBITDA", f"${metrics['ebitda']:,.0f}")
+            st.metric("Gross Margin", f"{headline['gross_margin']:.1f}%")
+            st.metric("EBITDA", f"${headline['ebitda']:,.0f}")
         
         with col3:
-            st.metric("EBITDA Margin", f"{metrics['ebitda_margin']:.1f}%")
-            st.metric("EBIT", f"${metrics['ebit']:,.0f}")
+            st.metric("EBITDA Margin", f"{headline['ebitda_margin']:.1f}%")
+            st.metric("EBIT", f"${headline['ebit']:,.0f}")
         
         with col4:
-            st.metric("EBIT Margin", f"{metrics['ebit_margin']:.1f}%")
-            st.metric("PBT", f"${metrics['pbt']:,.0f}")
+            st.metric("EBIT Margin", f"{headline['ebit_margin']:.1f}%")
+            st.metric("PBT", f"${headline['pbt']:,.0f}")
         
         st.markdown("---")
         
-        # Tabs for different analyses
+        # Cache key for everything derived from this view (ledger, analysis mode and periods)
+        view_key = ledger_key + (period_selection if has_time_dimension else None, tuple(selected_periods or ()))
+        view_periods = selected_periods or None
+        totals = rollup_slice(cube, 'category', view_periods)
+        gl_totals = view_gl_totals(cube, view_periods)
+        
+        # Tabs for different analyses; lazy tabs rerun on switch and build only the open one
+        tab_options = {'key': 'analysis_tabs', 'on_change': 'rerun'} if lazy_tabs else {}
+        extra_labels = (["🏢 Consolidation"] if eliminated is not None else []) + \
+                       (["📐 Budget Variance"] if budget_cube is not None else []) + \
+                       (["🚨 Anomalies"] if has_time_dimension else [])
         if has_time_dimension and period_selection == "Trend Analysis":
-            tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["📈 Trends", "🎯 Optimization", "📊 P&L Waterfall", "💰 Revenue Analysis", "💸 Cost Analysis", "📋 Detailed Data"])
+            tab1, tab2, tab3, tab4, tab5, tab6, *extra_tabs = st.tabs(["📈 Trends", "🎯 Optimization", "📊 P&L Waterfall", "💰 Revenue Analysis", "💸 Cost Analysis", "📋 Detailed Data"] + extra_labels, **tab_options)
         else:
-            tab1, tab2, tab3, tab4, tab5 = st.tabs(["🎯 Optimization", "📊 P&L Waterfall", "💰 Revenue Analysis", "💸 Cost Analysis", "📋 Detailed Data"])
+            tab1, tab2, tab3, tab4, tab5, *extra_tabs = st.tabs(["🎯 Optimization", "📊 P&L Waterfall", "💰 Revenue Analysis", "💸 Cost Analysis", "📋 Detailed Data"] + extra_labels, **tab_options)
         
         # Trend Analysis Tab (only if time dimension exists)
         if has_time_dimension and period_selection == "Trend Analysis":
             with tab1:
-                st.header("📈 Month-over-Month Trend Analysis")
-                
-                # Create trend dataframe
-                trend_metrics = []
-                for period in sorted(df['month_name'].unique()):
-                    period_df = df[df['month_name'] == period]
-                    period_metrics = calculate_metrics(period_df)
-                    trend_metrics.append({
-                        'Period': period,
-                        'Revenue': period_metrics['total_revenue'],
-                        'Gross Profit': period_metrics['gross_profit'],
-                        'EBITDA': period_metrics['ebitda'],
-                        'EBIT': period_metrics['ebit'],
-                        'PBT': period_metrics['pbt'],
-                        'Gross Margin %': period_metrics['gross_margin'],
-                        'EBITDA Margin %': period_metrics['ebitda_margin'],
-                        'EBIT Margin %': period_metrics['ebit_margin']
-                    })
-                
-                trend_df = pd.DataFrame(trend_metrics)
-                
-                # Revenue & Profit Trends
-                st.subheader("💰 Revenue & Profitability Trends")
-                fig_trend1 = go.Figure()
-                fig_trend1.add_trace(go.Scatter(x=trend_df['Period'], y=trend_df['Revenue'], 
-                                               mode='lines+markers', name='Revenue', line=dict(width=3)))
-                fig_trend1.add_trace(go.Scatter(x=trend_df['Period'], y=trend_df['Gross Profit'], 
-                                               mode='lines+markers', name='Gross Profit'))
-                fig_trend1.add_trace(go.Scatter(x=trend_df['Period'], y=trend_df['EBITDA'], 
-                                               mode='lines+markers', name='EBITDA'))
-                fig_trend1.add_trace(go.Scatter(x=trend_df['Period'], y=trend_df['EBIT'], 
-                                               mode='lines+markers', name='EBIT'))
-                fig_trend1.update_layout(height=500, title="Financial Performance Over Time",
-                                        yaxis_title="Amount ($)", xaxis_title="Period")
-                st.plotly_chart(fig_trend1, use_container_width=True)
-                
-                # Margin Trends
-                st.subheader("📊 Margin Trends")
-                fig_trend2 = go.Figure()
-                fig_trend2.add_trace(go.Scatter(x=trend_df['Period'], y=trend_df['Gross Margin %'], 
-                                               mode='lines+markers', name='Gross Margin', line=dict(width=3)))
-                fig_trend2.add_trace(go.Scatter(x=trend_df['Period'], y=trend_df['EBITDA Margin %'], 
-                                               mode='lines+markers', name='EBITDA Margin'))
-                fig_trend2.add_trace(go.Scatter(x=trend_df['Period'], y=trend_df['EBIT Margin %'], 
-                                               mode='lines+markers', name='EBIT Margin'))
-                fig_trend2.update_layout(height=500, title="Margin Performance Over Time",
-                                        yaxis_title="Margin (%)", xaxis_title="Period")
-                st.plotly_chart(fig_trend2, use_container_width=True)
-                
-                # MoM Growth Analysis
-                st.subheader("📈 Month-over-Month Growth")
-                if len(trend_df) > 1:
-                    mom_growth = pd.DataFrame({
-                        'Period': trend_df['Period'].iloc[1:].values,
-                        'Revenue Growth %': ((trend_df['Revenue'].iloc[1:].values - trend_df['Revenue'].iloc[:-1].values) / 
-                                           trend_df['Revenue'].iloc[:-1].values * 100),
-                        'EBITDA Growth %': ((trend_df['EBITDA'].iloc[1:].values - trend_df['EBITDA'].iloc[:-1].values) / 
-                                          trend_df['EBITDA'].iloc[:-1].abs().values * 100)
-                    })
+                if tab_is_open(tab1, lazy_tabs):
+                    st.header("📈 Month-over-Month Trend Analysis")
                     
-                    fig_growth = go.Figure()
-                    fig_growth.add_trace(go.Bar(x=mom_growth['Period'], y=mom_growth['Revenue Growth %'], 
-                                               name='Revenue Growth %', marker_color='lightblue'))
-                    fig_growth.add_trace(go.Bar(x=mom_growth['Period'], y=mom_growth['EBITDA Growth %'], 
-                                               name='EBITDA Growth %', marker_color='lightgreen'))
-                    fig_growth.update_layout(height=400, title="Month-over-Month Growth Rates",
-                                           yaxis_title="Growth (%)", barmode='group')
-                    st.plotly_chart(fig_growth, use_container_width=True)
-                
-                # Period comparison table
-                st.subheader("📋 Period Comparison Table")
-                comparison_df = trend_df.copy()
-                for col in ['Revenue', 'Gross Profit', 'EBITDA', 'EBIT', 'PBT']:
-                    comparison_df[col] = comparison_df[col].apply(lambda x: f"${x:,.0f}")
-                for col in ['Gross Margin %', 'EBITDA Margin %', 'EBIT Margin %']:
-                    comparison_df[col] = comparison_df[col].apply(lambda x: f"{x:.1f}%")
-                st.dataframe(comparison_df, use_container_width=True, hide_index=True)
+                    # Trend dataframe comes straight from the per-period metrics cube
+                    trend_df = trend_frame(metrics_by_period)
+                    # Windows and growth run over the signed P&L lines of the same periods
+                    view_lines = rollup_lines_by_period(cube).loc[metrics_by_period.index]
+                    
+                    # Revenue & Profit Trends
+                    st.subheader("💰 Revenue & Profitability Trends")
+                    st.plotly_chart(chart_figure(view_key, 'trend_performance', trend_df), use_container_width=True)
+                    
+                    # Margin Trends
+                    st.subheader("📊 Margin Trends")
+                    st.plotly_chart(chart_figure(view_key, 'trend_margins', trend_df), use_container_width=True)
+                    
+                    # MoM Growth Analysis
+                    st.subheader("📈 Month-over-Month Growth")
+                    if len(trend_df) > 1:
+                        growth_df = trend_frame(metric_growth(view_lines, lag=1)).iloc[1:]
+                        st.plotly_chart(chart_figure(view_key, 'mom_growth', growth_df), use_container_width=True)
+                    
+                    # Period comparison table
+                    st.subheader("📋 Period Comparison Table")
+                    st.dataframe(format_trend(trend_df), use_container_width=True, hide_index=True)
+                    
+                    # Period-to-date and rolling windows over the same per-period metrics
+                    st.subheader("📆 Period-to-Date & Rolling Metrics")
+                    window_basis = st.radio("Basis", [b for b in METRIC_WINDOWS if b != 'Month'], horizontal=True)
+                    window_df = trend_frame(window_metrics(view_lines, window_basis))
+                    st.plotly_chart(chart_figure(view_key + (window_basis,), 'trend_performance', window_df),
+                                    use_container_width=True, key='window_trend')
+                    st.dataframe(format_trend(window_df), use_container_width=True, hide_index=True)
+                    
+                    # Year-over-year growth on the chosen basis
+                    st.subheader(f"📅 Year-over-Year Growth ({window_basis})")
+                    yoy_df = trend_frame(metric_growth(view_lines, lag=12, basis=window_basis))
+                    if yoy_df['Revenue'].notna().any():
+                        st.dataframe(format_trend(yoy_df, growth=True), use_container_width=True, hide_index=True)
+                    else:
+                        st.info("Year-over-year growth needs the same months a year earlier in the ledger")
             
             # Adjust tab references for remaining tabs
             opt_tab, waterfall_tab, rev_tab, cost_tab, data_tab = tab2, tab3, tab4, tab5, tab6
@@ -604,9 +778,10 @@ else:
                     }
                     
                     with st.expander(f"{priority_color[rec['priority']]} **{rec['category']}** - {rec['priority']} Priority"):
-                        st.markdown(f"**Issue:** {rec['issue']}")
-                        st.markdown(f"**Recommended Action:** {rec['action']}")
-                        st.markdown(f"**Potential Impact:** {rec['impact']}")
+                        text = render_recommendation(rec)
+                        st.markdown(f"**Issue:** {text['issue']}")
+                        st.markdown(f"**Recommended Action:** {text['action']}")
+                        st.markdown(f"**Potential Impact:** {text['impact']}")
             
             # Quick Win Summary
             st.markdown("---")
@@ -614,223 +789,294 @@ else:
             high_priority = [r for r in recommendations if r['priority'] in ['Critical', 'High']]
             if len(high_priority) > 0:
                 st.markdown(f"**{len(high_priority)} high-priority items** identified for immediate action")
-                total_potential_impact = sum([float(r['impact'].split(')[1].replace(',', '').split()[0]) 
-                                             for r in high_priority if ' in r['impact'] and 'save' in r['impact']])
+                high_priority_df = recommendations_frame(high_priority)
+                total_potential_impact = high_priority_df.loc[high_priority_df['savings_kind'] == 'saving',
+                                                              'estimated_savings'].sum()
                 if total_potential_impact > 0:
                     st.markdown(f"**Estimated annual savings potential: ${total_potential_impact:,.0f}**")
         
         with waterfall_tab:
-            st.header("📊 P&L Waterfall Analysis")
-            
-            # Create waterfall data
-            waterfall_data = {
-                'Metric': ['Revenue', 'COGS', 'Gross Profit', 'OPEX', 'EBITDA', 'D&A', 'EBIT', 'Interest', 'Non-Op', 'PBT'],
-                'Amount': [
-                    metrics['total_revenue'],
-                    -metrics['total_cogs'],
-                    metrics['gross_profit'],
-                    -metrics['total_opex'],
-                    metrics['ebitda'],
-                    -metrics['total_da'],
-                    metrics['ebit'],
-                    metrics['net_interest'],
-                    metrics['non_operating'],
-                    metrics['pbt']
-                ]
-            }
-            
-            # Create waterfall chart
-            fig = go.Figure(go.Waterfall(
-                name="P&L Waterfall",
-                orientation="v",
-                measure=["absolute", "relative", "total", "relative", "total", "relative", "total", "relative", "relative", "total"],
-                x=waterfall_data['Metric'],
-                y=waterfall_data['Amount'],
-                text=[f"${v:,.0f}" for v in waterfall_data['Amount']],
-                textposition="outside",
-                connector={"line": {"color": "rgb(63, 63, 63)"}},
-                decreasing={"marker": {"color": "#EF5350"}},
-                increasing={"marker": {"color": "#66BB6A"}},
-                totals={"marker": {"color": "#42A5F5"}}
-            ))
-            
-            fig.update_layout(
-                title="P&L Waterfall: Revenue to Pre-Tax Profit",
-                height=600,
-                showlegend=False,
-                yaxis_title="Amount ($)"
-            )
-            
-            st.plotly_chart(fig, use_container_width=True)
-            
-            # Margin progression
-            st.subheader("📉 Margin Progression")
-            margin_df = pd.DataFrame({
-                'Stage': ['Gross Margin', 'EBITDA Margin', 'EBIT Margin', 'PBT Margin'],
-                'Margin %': [metrics['gross_margin'], metrics['ebitda_margin'], 
-                           metrics['ebit_margin'], metrics['pbt_margin']]
-            })
-            
-            fig2 = px.bar(margin_df, x='Stage', y='Margin %', 
-                         color='Margin %',
-                         color_continuous_scale='RdYlGn',
-                         text='Margin %')
-            fig2.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
-            fig2.update_layout(height=400, showlegend=False)
-            st.plotly_chart(fig2, use_container_width=True)
+            if tab_is_open(waterfall_tab, lazy_tabs):
+                st.header("📊 P&L Waterfall Analysis")
+                st.plotly_chart(chart_figure(view_key, 'waterfall', metrics), use_container_width=True)
+                
+                # Margin progression
+                st.subheader("📉 Margin Progression")
+                st.plotly_chart(chart_figure(view_key, 'margin_progression', metrics), use_container_width=True)
         
         with rev_tab:
-            st.header("💰 Revenue Analysis")
-            
-            # Revenue by category
-            revenue_df = df[df['type'] == 'Revenue'].copy()
-            revenue_by_cat = revenue_df.groupby('category')['amount'].sum().sort_values(ascending=False)
-            
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                st.subheader("Revenue by Category")
-                fig3 = px.pie(values=revenue_by_cat.values, 
-                            names=revenue_by_cat.index,
-                            title="Revenue Distribution")
-                fig3.update_traces(textposition='inside', textinfo='percent+label')
-                st.plotly_chart(fig3, use_container_width=True)
-            
-            with col2:
-                st.subheader("Top 10 Revenue Line Items")
-                top_revenue = revenue_df.nlargest(10, 'amount')[['name', 'amount', 'category']]
-                top_revenue['amount'] = top_revenue['amount'].apply(lambda x: f"${x:,.0f}")
-                st.dataframe(top_revenue, hide_index=True, use_container_width=True)
-            
-            # Revenue concentration analysis
-            st.subheader("📊 Revenue Concentration Risk")
-            top_3_revenue = revenue_by_cat.head(3).sum()
-            concentration = (top_3_revenue / metrics['total_revenue']) * 100
-            
-            st.metric("Top 3 Categories Concentration", f"{concentration:.1f}%")
-            if concentration > 70:
-                st.warning("⚠️ High revenue concentration risk. Consider diversifying revenue streams.")
-            else:
-                st.success("✅ Healthy revenue diversification")
+            if tab_is_open(rev_tab, lazy_tabs):
+                st.header("💰 Revenue Analysis")
+                
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    st.subheader("Revenue by Category")
+                    st.plotly_chart(chart_figure(view_key, 'revenue_mix', totals), use_container_width=True)
+                
+                with col2:
+                    revenue_view = st.radio("Revenue line items", list(LINE_ITEM_VIEWS), horizontal=True)
+                    st.subheader(f"{revenue_view} Revenue Line Items")
+                    st.dataframe(line_item_table(gl_totals, ['Revenue'], revenue_view, signed=True),
+                                 hide_index=True, use_container_width=True)
+                
+                # Revenue concentration analysis
+                st.subheader("📊 Revenue Concentration Risk")
+                revenue_by_cat = type_totals(totals, ['Revenue']).sort_values(ascending=False)
+                top_3_revenue = revenue_by_cat.head(3).sum()
+                concentration = safe_ratio(top_3_revenue, revenue_by_cat.sum())
+                
+                st.metric("Top 3 Categories Concentration", "n/a" if pd.isna(concentration) else f"{concentration:.1f}%")
+                if pd.isna(concentration):
+                    st.info("No revenue in view")
+                elif concentration > 70:
+                    st.warning("⚠️ High revenue concentration risk. Consider diversifying revenue streams.")
+                else:
+                    st.success("✅ Healthy revenue diversification")
+                
+                # Drill from a revenue category into its GL codes
+                st.subheader("🔎 Revenue Category Drill-Down")
+                revenue_category = st.selectbox("Revenue category", revenue_by_cat.index.get_level_values('category'))
+                if revenue_category is not None:
+                    st.dataframe(drill_down_table(cube, revenue_category, view_periods, signed=True),
+                                 hide_index=True, use_container_width=True)
         
         with cost_tab:
-            st.header("💸 Cost Analysis")
-            
-            # Combined cost analysis
-            cost_df = df[df['type'].isin(['COGS', 'OPEX'])].copy()
-            cost_by_category = cost_df.groupby(['type', 'category'])['amount'].sum().abs()
-            
-            # Cost structure treemap
-            st.subheader("Cost Structure Breakdown")
-            
-            cost_tree_df = cost_df.groupby(['type', 'category'])['amount'].sum().abs().reset_index()
-            cost_tree_df.columns = ['Type', 'Category', 'Amount']
-            
-            fig4 = px.treemap(cost_tree_df, 
-                            path=['Type', 'Category'], 
-                            values='Amount',
-                            title='Cost Structure Hierarchy',
-                            color='Amount',
-                            color_continuous_scale='Reds')
-            fig4.update_layout(height=600)
-            st.plotly_chart(fig4, use_container_width=True)
-            
-            # Cost efficiency metrics
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                st.subheader("Cost as % of Revenue")
-                cost_metrics = pd.DataFrame({
-                    'Cost Type': ['COGS', 'OPEX', 'D&A', 'Total Costs'],
-                    'Amount': [metrics['total_cogs'], metrics['total_opex'], 
-                              metrics['total_da'], 
-                              metrics['total_cogs'] + metrics['total_opex'] + metrics['total_da']],
-                    '% of Revenue': [
-                        (metrics['total_cogs'] / metrics['total_revenue'] * 100),
-                        (metrics['total_opex'] / metrics['total_revenue'] * 100),
-                        (metrics['total_da'] / metrics['total_revenue'] * 100),
-                        ((metrics['total_cogs'] + metrics['total_opex'] + metrics['total_da']) / metrics['total_revenue'] * 100)
-                    ]
-                })
-                cost_metrics['Amount'] = cost_metrics['Amount'].apply(lambda x: f"${x:,.0f}")
-                cost_metrics['% of Revenue'] = cost_metrics['% of Revenue'].apply(lambda x: f"{x:.1f}%")
-                st.dataframe(cost_metrics, hide_index=True, use_container_width=True)
-            
-            with col2:
-                st.subheader("Top 10 Cost Items")
-                top_costs = cost_df.nlargest(10, 'amount', keep='first')[['name', 'amount', 'category']]
-                top_costs['amount'] = top_costs['amount'].abs().apply(lambda x: f"${x:,.0f}")
-                st.dataframe(top_costs, hide_index=True, use_container_width=True)
-            
-            # Cost optimization opportunities
-            st.subheader("🎯 Cost Optimization Matrix")
-            
-            cost_summary = cost_df.groupby('category').agg({
-                'amount': lambda x: abs(x.sum())
-            }).reset_index()
-            cost_summary['% of Total Cost'] = (cost_summary['amount'] / cost_summary['amount'].sum() * 100)
-            cost_summary = cost_summary.sort_values('amount', ascending=False).head(10)
-            
-            fig5 = px.bar(cost_summary, 
-                         x='category', 
-                         y='amount',
-                         text='amount',
-                         title='Top 10 Cost Categories',
-                         labels={'amount': 'Cost ($)', 'category': 'Category'})
-            fig5.update_traces(texttemplate='$%{text:,.0f}', textposition='outside')
-            fig5.update_layout(height=500, xaxis_tickangle=-45)
-            st.plotly_chart(fig5, use_container_width=True)
+            if tab_is_open(cost_tab, lazy_tabs):
+                st.header("💸 Cost Analysis")
+                
+                # Cost structure treemap
+                st.subheader("Cost Structure Breakdown")
+                st.plotly_chart(chart_figure(view_key, 'cost_structure', totals), use_container_width=True)
+                
+                # Cost efficiency metrics
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    st.subheader("Cost as % of Revenue")
+                    cost_metrics = pd.DataFrame({
+                        'Cost Type': ['COGS', 'OPEX', 'D&A', 'Total Costs'],
+                        'Amount': [metrics['total_cogs'], metrics['total_opex'], 
+                                  metrics['total_da'], 
+                                  metrics['total_cogs'] + metrics['total_opex'] + metrics['total_da']],
+                    })
+                    cost_metrics['% of Revenue'] = safe_ratio(cost_metrics['Amount'], metrics['total_revenue'])
+                    cost_metrics['Amount'] = cost_metrics['Amount'].apply(lambda x: f"${x:,.0f}")
+                    cost_metrics['% of Revenue'] = cost_metrics['% of Revenue'].apply(
+                        lambda x: "n/a" if pd.isna(x) else f"{x:.1f}%")
+                    st.dataframe(cost_metrics, hide_index=True, use_container_width=True)
+                
+                with col2:
+                    cost_view = st.radio("Cost line items", list(LINE_ITEM_VIEWS), horizontal=True)
+                    st.subheader(f"{cost_view} Cost Items")
+                    st.dataframe(line_item_table(gl_totals, ['COGS', 'OPEX'], cost_view),
+                                 hide_index=True, use_container_width=True)
+                
+                # Cost optimization opportunities
+                st.subheader("🎯 Cost Optimization Matrix")
+                st.plotly_chart(chart_figure(view_key, 'cost_matrix', totals), use_container_width=True)
+                
+                # Drill from a cost category into its GL codes
+                st.subheader("🔎 Cost Category Drill-Down")
+                cost_by_cat = type_totals(totals, ['COGS', 'OPEX']).abs().sort_values(ascending=False)
+                cost_category = st.selectbox("Cost category", cost_by_cat.index.get_level_values('category'))
+                if cost_category is not None:
+                    st.dataframe(drill_down_table(cube, cost_category, view_periods),
+                                 hide_index=True, use_container_width=True)
         
         with data_tab:
-            st.header("📋 Detailed Transaction Data")
-            
-            # Filters
-            col1, col2, col3 = st.columns(3)
-            
-            with col1:
-                type_filter = st.multiselect("Filter by Type", 
-                                            options=df['type'].unique(),
-                                            default=df['type'].unique())
-            
-            with col2:
-                category_filter = st.multiselect("Filter by Category",
-                                                options=df['category'].unique())
-            
-            with col3:
-                search_term = st.text_input("Search GL Code or Name")
-            
-            # Apply filters
-            filtered_df = df[df['type'].isin(type_filter)].copy()
-            
-            if category_filter:
-                filtered_df = filtered_df[filtered_df['category'].isin(category_filter)]
-            
-            if search_term:
-                filtered_df = filtered_df[
-                    filtered_df['gl_code'].str.contains(search_term, case=False, na=False) |
-                    filtered_df['name'].str.contains(search_term, case=False, na=False)
-                ]
-            
-            # Display columns based on whether time dimension exists
-            display_cols = ['gl_code', 'name', 'category', 'type', 'amount']
-            if has_time_dimension and 'month_name' in filtered_df.columns:
-                display_cols.insert(1, 'month_name')
-            
-            # Display data
-            st.dataframe(
-                filtered_df[display_cols].sort_values('amount', ascending=False),
-                use_container_width=True,
-                height=600
-            )
-            
-            # Download button
-            csv = filtered_df.to_csv(index=False)
-            st.download_button(
-                label="📥 Download Filtered Data as CSV",
-                data=csv,
-                file_name=f"pl_analysis_{datetime.now().strftime('%Y%m%d')}.csv",
-                mime="text/csv"
-            )
+            if tab_is_open(data_tab, lazy_tabs):
+                st.header("📋 Detailed Transaction Data")
+                if 'line_count' in df.columns:
+                    st.caption("Rows are per-period GL totals (`line_count` = source lines)")
+                
+                # Filters
+                col1, col2, col3 = st.columns(3)
+                
+                with col1:
+                    type_filter = st.multiselect("Filter by Type", 
+                                                options=df['type'].unique().tolist(),
+                                                default=df['type'].unique().tolist())
+                
+                with col2:
+                    category_filter = st.multiselect("Filter by Category",
+                                                    options=df['category'].unique().tolist())
+                
+                with col3:
+                    search_term = st.text_input("Search GL Code or Name")
+                
+                # Apply filters as one row mask over the view
+                row_mask = df['type'].isin(type_filter).to_numpy()
+                
+                if category_filter:
+                    row_mask = row_mask & df['category'].isin(category_filter).to_numpy()
+                
+                if search_term:
+                    # Match the distinct accounts, then pick their rows from the code -> rows index
+                    positions, gl_index = detail_gl_index(view_key, df)
+                    search_mask = np.zeros(len(df), dtype=bool)
+                    search_mask[gl_rows(positions, gl_index, search_gl_codes(search_term))] = True
+                    row_mask = row_mask & search_mask
+                
+                # Filtered rows in descending amount order, from the view's precomputed sort order
+                sort_order = detail_sort_order(view_key, df)
+                filtered_rows = sort_order[row_mask[sort_order]]
+                
+                # Display columns based on whether time dimension exists
+                display_cols = ['gl_code', 'name', 'category', 'type', 'amount']
+                if has_time_dimension and 'month_name' in df.columns:
+                    display_cols.insert(1, 'month_name')
+                if 'entity' in df.columns:
+                    display_cols.insert(0, 'entity')
+                if 'line_count' in df.columns:
+                    display_cols.append('line_count')
+                
+                # Only the visible page is materialised and sent to the browser
+                col1, col2 = st.columns([1, 3])
+                with col1:
+                    page_size = st.selectbox("Rows per page", DETAIL_PAGE_SIZES, index=1)
+                page_count = max(1, -(-len(filtered_rows) // page_size))
+                with col2:
+                    page = st.number_input(f"Page (of {page_count:,})", min_value=1, max_value=page_count, value=1)
+                page_start = (page - 1) * page_size
+                page_rows = filtered_rows[page_start:page_start + page_size]
+                
+                # Display data (fixed-point amounts shown in currency units)
+                page_df = df.iloc[page_rows][display_cols]
+                st.dataframe(
+                    page_df.assign(amount=amount_units(page_df['amount'], amount_scale(df))),
+                    use_container_width=True,
+                    height=600
+                )
+                st.caption(f"Rows {min(page_start + 1, len(filtered_rows)):,}–{page_start + len(page_rows):,} "
+                           f"of {len(filtered_rows):,}")
+                
+                # Download button; the CSV is written in chunks only when clicked
+                st.download_button(
+                    label="📥 Download Filtered Data as CSV",
+                    data=lambda: ledger_csv(df[row_mask]),
+                    file_name=f"pl_analysis_{datetime.now().strftime('%Y%m%d')}.csv",
+                    mime="text/csv"
+                )
+                
+                if streaming and spill_detail and os.path.exists(detail_spill_path(file_hash)):
+                    st.download_button(
+                        label="📥 Download Line-Level Detail as CSV",
+                        data=lambda: read_detail_spill(file_hash),
+                        file_name=f"pl_detail_{datetime.now().strftime('%Y%m%d')}.csv",
+                        mime="text/csv"
+                    )
+                
+                # Memory report for sizing containers
+                with st.expander("🧠 Memory Report"):
+                    mem_report = memory_report(df)
+                    st.markdown(f"**Ledger in memory:** {mem_report['bytes'].sum() / 1e6:,.1f} MB "
+                                f"across {len(df):,} rows{' (compact mode)' if compact_mode else ''}")
+                    if peak_rss_after_load is not None:
+                        st.markdown(f"**Peak RSS:** {peak_rss_after_load / 1e6:,.0f} MB "
+                                    f"(+{(peak_rss_after_load - peak_rss_before_load) / 1e6:,.0f} MB during this load; "
+                                    f"0 when served from cache)")
+                    st.dataframe(mem_report.assign(MB=mem_report['bytes'] / 1e6), use_container_width=True)
+        
+        extra_tabs = dict(zip(extra_labels, extra_tabs))
+        
+        # Consolidation Tab (only for entity uploads)
+        if "🏢 Consolidation" in extra_tabs:
+            consolidation_tab = extra_tabs["🏢 Consolidation"]
+            with consolidation_tab:
+                if tab_is_open(consolidation_tab, lazy_tabs):
+                    st.header("🏢 Group Consolidation")
+                    eliminated_view = eliminated
+                    if selected_periods:
+                        eliminated_view = eliminated[eliminated['month_name'].astype(str).isin(selected_periods)]
+                    entity_table = consolidation_metrics(df, eliminated_view)
+                    st.caption("Entities are standalone (before eliminations); the Group row is the consolidated P&L "
+                               "for every period in view")
+                    
+                    st.plotly_chart(chart_figure(view_key, 'entity_pnl', entity_table), use_container_width=True)
+                    
+                    entity_df = entity_table[list(TREND_COLUMNS)].rename(columns=TREND_COLUMNS)
+                    for col in ['Revenue', 'Gross Profit', 'EBITDA', 'EBIT', 'PBT']:
+                        entity_df[col] = entity_df[col].apply(lambda x: f"${x:,.0f}")
+                    for col in ['Gross Margin %', 'EBITDA Margin %', 'EBIT Margin %']:
+                        entity_df[col] = entity_df[col].apply(lambda x: f"{x:.1f}%")
+                    st.dataframe(entity_df, use_container_width=True)
+                    
+                    # Intercompany eliminations
+                    st.subheader("🔁 Intercompany Eliminations")
+                    eliminations = elimination_summary(eliminated_view)
+                    unmatched = eliminations['net'].sum() if len(eliminations) else 0.0
+                    st.metric("Net eliminated (unmatched intercompany)", f"${unmatched:,.0f}")
+                    st.dataframe(eliminations, use_container_width=True)
+        
+        # Budget Variance Tab (only with a budget/forecast upload)
+        if "📐 Budget Variance" in extra_tabs:
+            budget_tab = extra_tabs["📐 Budget Variance"]
+            with budget_tab:
+                if tab_is_open(budget_tab, lazy_tabs):
+                    st.header("📐 Budget / Forecast Variance")
+                    if len(budget_unknown) > 0:
+                        st.warning(f"⚠️ {len(budget_unknown)} budget GL codes not recognized and left out")
+                    
+                    # Actuals and budget joined on (GL hierarchy, month) from their rollup cubes
+                    aligned = align_budget(cube, budget_cube, view_periods)
+                    metric_var = metric_variance(aligned)
+                    st.caption("Compared over the months with actuals in view; budget months not yet reported "
+                               "are excluded")
+                    
+                    col1, col2, col3 = st.columns(3)
+                    for col, metric, label in [(col1, 'total_revenue', "Revenue"), (col2, 'ebitda', "EBITDA"),
+                                               (col3, 'pbt', "PBT")]:
+                        with col:
+                            pct = metric_var.at[metric, 'variance_pct']
+                            st.metric(f"{label} vs Budget", f"${metric_var.at[metric, 'actual']:,.0f}",
+                                      f"{metric_var.at[metric, 'variance']:+,.0f}"
+                                      + ("" if pd.isna(pct) else f" ({pct:+.1f}%)"))
+                    
+                    st.plotly_chart(chart_figure(view_key + budget_key, 'budget_variance', metric_var),
+                                    use_container_width=True)
+                    
+                    st.subheader("📋 Metric Variance")
+                    margins = [m for m in metric_var.index if m.endswith('_margin')]
+                    st.dataframe(format_variance(metric_var, margins), use_container_width=True)
+                    
+                    st.subheader("📋 Category Variance")
+                    st.caption("Signed amounts: a positive variance adds to profit (more income or less cost)")
+                    category_var = category_variance(aligned)
+                    st.dataframe(format_variance(category_var.reset_index(level='type', drop=True)),
+                                 use_container_width=True)
+        
+        # Anomalies Tab (only with a time dimension)
+        if "🚨 Anomalies" in extra_tabs:
+            anomaly_tab = extra_tabs["🚨 Anomalies"]
+            with anomaly_tab:
+                if tab_is_open(anomaly_tab, lazy_tabs):
+                    st.header("🚨 GL Anomalies")
+                    st.caption(f"Each GL code's monthly amount is scored against that code's own history across all "
+                               f"periods (codes need {ANOMALY_MIN_PERIODS}+ months with postings); periods in view "
+                               f"are listed")
+                    
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        anomaly_method = st.radio("Method", list(ANOMALY_THRESHOLDS), horizontal=True,
+                                                  format_func={'mad': "Median absolute deviation",
+                                                               'zscore': "Z-score"}.get)
+                    with col2:
+                        anomaly_threshold = st.slider("Flag when |score| exceeds", 2.0, 6.0,
+                                                      ANOMALY_THRESHOLDS[anomaly_method], 0.5)
+                    
+                    anomalies = flag_anomalies(cube, anomaly_method, anomaly_threshold, view_periods)
+                    st.metric("Flagged GL lines", f"{len(anomalies):,}")
+                    if len(anomalies) == 0:
+                        st.success("✅ No GL lines outside their usual range")
+                    else:
+                        anomaly_df = anomalies.rename(columns={
+                            'gl_code': 'GL Code', 'name': 'Account', 'category': 'Category', 'period': 'Period',
+                            'amount': 'Amount', 'expected': 'Expected', 'score': 'Score'})
+                        for col in ['Amount', 'Expected']:
+                            anomaly_df[col] = anomaly_df[col].apply(lambda x: f"${x:,.0f}")
+                        anomaly_df['Score'] = anomaly_df['Score'].apply(lambda x: f"{x:+.1f}")
+                        st.dataframe(anomaly_df, hide_index=True, use_container_width=True)
         
         # Footer with key insights
         st.markdown("---")
@@ -0,0 +1,1047 @@
+"""P&L analysis pipeline: GL mapping, ledger ingestion, metrics and recommendations
+
+Importable without Streamlit; main.py is the interactive front end and batch.py the
+headless one.
+"""
+import importlib.util
+import io
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# GL Code Mapping with Categories
+GL_CODE_MAPPING = {
+    # Revenue Categories
+    '41110': {'name': 'Scheduled Flight', 'category': 'Flight Revenue', 'type': 'Revenue'},
+    '41116': {'name': 'Revenue - Loyalty Point Redemption', 'category': 'Flight Revenue', 'type': 'Revenue'},
+    '41150': {'name': 'Refund and Chargeback', 'category': 'Flight Revenue', 'type': 'Revenue'},
+    '41151': {'name': 'Refund', 'category': 'Flight Revenue', 'type': 'Revenue'},
+    '4160C': {'name': 'Travel, Lifestyle and Shopping', 'category': 'Non-Airline Direct Revenue', 'type': 'Revenue'},
+    '41641': {'name': 'Commission', 'category': 'Non-Airline Direct Revenue', 'type': 'Revenue'},
+    '41643': {'name': 'Gross Billing - Merchandise', 'category': 'Non-Airline Direct Revenue', 'type': 'Revenue'},
+    '41648': {'name': 'Inflight Shopping Commission', 'category': 'Non-Airline Direct Revenue', 'type': 'Revenue'},
+    '41654': {'name': 'Gross Billing - Discount Pass', 'category': 'Non-Airline Direct Revenue', 'type': 'Revenue'},
+    '41658': {'name': 'Advertising and Partnerships', 'category': 'Non-Airline Direct Revenue', 'type': 'Revenue'},
+    '41649': {'name': 'Inflight Shopping Merchant Fees', 'category': 'Non-Airline Direct Revenue', 'type': 'Revenue'},
+    '41651': {'name': 'Refund', 'category': 'Non-Airline Direct Revenue', 'type': 'Revenue'},
+    '41675': {'name': 'Revenue - Discount', 'category': 'Non-Airline Direct Revenue', 'type': 'Revenue'},
+    '41332': {'name': 'Revenue - Inflight Duty Free Onboard', 'category': 'Non-Inflight Revenues', 'type': 'Revenue'},
+    '41321': {'name': 'Revenue - Inflight Merchandise Pre-book', 'category': 'Non-Inflight Revenues', 'type': 'Revenue'},
+    '41322': {'name': 'Revenue - Inflight Merchandise Onboard', 'category': 'Non-Inflight Revenues', 'type': 'Revenue'},
+    '41331': {'name': 'Revenue - Inflight Duty Free Pre-book', 'category': 'Non-Inflight Revenues', 'type': 'Revenue'},
+    '41264': {'name': 'Revenue - Service Fees', 'category': 'Non-Inflight Revenues', 'type': 'Revenue'},
+    '42114': {'name': 'Advertising - Publication', 'category': 'Non-Inflight Revenues', 'type': 'Revenue'},
+    '41801': {'name': 'Management Fee', 'category': 'Non-Inflight Revenues', 'type': 'Revenue'},
+    '45130': {'name': 'Gain / (Loss) on Disposal', 'category': 'Other Income', 'type': 'Revenue'},
+    '45132': {'name': 'Other Income - Gain/(Loss) on Asset Disposal', 'category': 'Other Income', 'type': 'Revenue'},
+    '45150': {'name': 'Others', 'category': 'Other Income', 'type': 'Revenue'},
+    '45199': {'name': 'Other Income - Others', 'category': 'Other Income', 'type': 'Revenue'},
+    
+    # Cost of Sales
+    '51711': {'name': 'Credit Card Commission', 'category': 'Sales And Distribution', 'type': 'COGS'},
+    '51621': {'name': 'Inflight Merchandise', 'category': 'Sales And Distribution', 'type': 'COGS'},
+    '51631': {'name': 'Duty Free', 'category': 'Sales And Distribution', 'type': 'COGS'},
+    '51664': {'name': 'Merchandise', 'category': 'Sales And Distribution', 'type': 'COGS'},
+    '51717': {'name': 'Commission paid to Partner', 'category': 'Sales And Distribution', 'type': 'COGS'},
+    '51718': {'name': 'Payment Gateway Fee', 'category': 'Sales And Distribution', 'type': 'COGS'},
+    '51719': {'name': 'Commission to AA.Com', 'category': 'Sales And Distribution', 'type': 'COGS'},
+    '51726': {'name': 'Collection Shortage', 'category': 'Sales And Distribution', 'type': 'COGS'},
+    '51749': {'name': 'Other Distribution Cost', 'category': 'Sales And Distribution', 'type': 'COGS'},
+    '51754': {'name': 'Merchant Fee', 'category': 'Sales And Distribution', 'type': 'COGS'},
+    '51256': {'name': 'Travelling - Others', 'category': 'Sales And Distribution', 'type': 'COGS'},
+    '51536': {'name': 'Freight Charges', 'category': 'Sales And Distribution', 'type': 'COGS'},
+    '51610': {'name': 'Inflight Meal and Beverage', 'category': 'Sales And Distribution', 'type': 'COGS'},
+    '51615': {'name': 'Inflight Amenities', 'category': 'Sales And Distribution', 'type': 'COGS'},
+    '51640': {'name': 'Other Inflight Cost', 'category': 'Sales And Distribution', 'type': 'COGS'},
+    '51648': {'name': 'Other Operating Cost - Inflight', 'category': 'Sales And Distribution', 'type': 'COGS'},
+    '51912': {'name': 'COS - First Mile/Last Mile', 'category': 'Other Cost Of Sales', 'type': 'COGS'},
+    '51913': {'name': 'COS - Teleportal', 'category': 'Other Cost Of Sales', 'type': 'COGS'},
+    '51942': {'name': 'Online Advertising Cost', 'category': 'Other Cost Of Sales', 'type': 'COGS'},
+    '51966': {'name': 'Point of Issuing Cost', 'category': 'Other Cost Of Sales', 'type': 'COGS'},
+    
+    # Operating Expenses - Direct Payroll
+    '51211': {'name': 'Basic Salary', 'category': 'Direct Payroll', 'type': 'OPEX'},
+    '51215': {'name': 'Allowance - Others', 'category': 'Direct Payroll', 'type': 'OPEX'},
+    '51218': {'name': 'Provident Fund - Employer', 'category': 'Direct Payroll', 'type': 'OPEX'},
+    '51219': {'name': 'Social Security Fund - Employer', 'category': 'Direct Payroll', 'type': 'OPEX'},
+    '51251': {'name': 'Human Resource Development Fund (HRDF)', 'category': 'Direct Payroll', 'type': 'OPEX'},
+    '51257': {'name': 'Accommodation - Hotels', 'category': 'Direct Payroll', 'type': 'OPEX'},
+    
+    # Operating Expenses - Indirect Payroll
+    '61111': {'name': 'Basic Salary', 'category': 'Indirect Payroll', 'type': 'OPEX'},
+    '61113': {'name': 'Bonus', 'category': 'Indirect Payroll', 'type': 'OPEX'},
+    '61114': {'name': 'Allowance', 'category': 'Indirect Payroll', 'type': 'OPEX'},
+    '61116': {'name': 'Medical Expenses', 'category': 'Indirect Payroll', 'type': 'OPEX'},
+    '61117': {'name': 'Provident Fund - Employer', 'category': 'Indirect Payroll', 'type': 'OPEX'},
+    '61118': {'name': 'Social Security Fund - Employer', 'category': 'Indirect Payroll', 'type': 'OPEX'},
+    '61149': {'name': 'Other Payroll Cost', 'category': 'Indirect Payroll', 'type': 'OPEX'},
+    '61151': {'name': 'Human Resource Development Fund (HRDF)', 'category': 'Indirect Payroll', 'type': 'OPEX'},
+    '61152': {'name': 'Housing Fund Contribution', 'category': 'Indirect Payroll', 'type': 'OPEX'},
+    '61153': {'name': 'Training', 'category': 'Indirect Payroll', 'type': 'OPEX'},
+    '61154': {'name': 'Uniform & Accessories', 'category': 'Indirect Payroll', 'type': 'OPEX'},
+    '61155': {'name': 'Travelling - Air Ticket / Other Transport', 'category': 'Indirect Payroll', 'type': 'OPEX'},
+    '61156': {'name': 'Travelling - Others', 'category': 'Indirect Payroll', 'type': 'OPEX'},
+    '61157': {'name': 'Accommodation', 'category': 'Indirect Payroll', 'type': 'OPEX'},
+    '61160': {'name': 'Recruitment Expenses', 'category': 'Indirect Payroll', 'type': 'OPEX'},
+    '61189': {'name': 'Other Personnel Cost', 'category': 'Indirect Payroll', 'type': 'OPEX'},
+    
+    # Marketing & Advertising
+    '61211': {'name': 'Advertising - Outdoor', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    '61213': {'name': 'Advertising - Radio', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    '61215': {'name': 'Advertising - Internet', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    '61218': {'name': 'Point Of Display', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    '61219': {'name': 'Design/Production', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    '61220': {'name': 'Events and Fairs', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    '61221': {'name': 'Gift - General', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    '61223': {'name': 'Sponsorship', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    '61226': {'name': 'Special Projects', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    '61227': {'name': 'Photography', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    '61228': {'name': 'License Fee', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    '61229': {'name': 'Web Transaction Fees', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    '61230': {'name': 'Communication Materials', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    '61232': {'name': 'Merchandise Consumption', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    '61233': {'name': 'Loyalty Cost', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    '61237': {'name': 'Regional Special Project', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    '61239': {'name': 'Advertising - Always On Digital (MKT)', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    '61240': {'name': 'Marketing Incentive', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    '61241': {'name': 'Partnership Funds Spending', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    '61249': {'name': 'Other Advertising Cost', 'category': 'Marketing & Advertising', 'type': 'OPEX'},
+    
+    # Insurance & Fees
+    '61311': {'name': 'Group Hospitalisation', 'category': 'Insurance', 'type': 'OPEX'},
+    '61312': {'name': 'Group Term Life', 'category': 'Insurance', 'type': 'OPEX'},
+    '61313': {'name': 'Group Personal Accident', 'category': 'Insurance', 'type': 'OPEX'},
+    '61349': {'name': 'Other Insurance Cost', 'category': 'Insurance', 'type': 'OPEX'},
+    '61411': {'name': 'Management Fees', 'category': 'Professional Fees', 'type': 'OPEX'},
+    '61412': {'name': 'Audit Fees', 'category': 'Professional Fees', 'type': 'OPEX'},
+    '61413': {'name': 'Professional Fees', 'category': 'Professional Fees', 'type': 'OPEX'},
+    '61415': {'name': 'Secretarial Fees', 'category': 'Professional Fees', 'type': 'OPEX'},
+    '61419': {'name': 'Consultant Fees', 'category': 'Professional Fees', 'type': 'OPEX'},
+    '61420': {'name': 'Stamping Fees', 'category': 'Professional Fees', 'type': 'OPEX'},
+    '61421': {'name': 'Tax Fees', 'category': 'Professional Fees', 'type': 'OPEX'},
+    '61422': {'name': 'Fines / Penalties', 'category': 'Professional Fees', 'type': 'OPEX'},
+    '61423': {'name': 'Brand License Cost', 'category': 'Professional Fees', 'type': 'OPEX'},
+    '61425': {'name': 'AASEA Service Cost', 'category': 'Professional Fees', 'type': 'OPEX'},
+    '61426': {'name': 'ICT Shared Service Cost', 'category': 'Professional Fees', 'type': 'OPEX'},
+    '61449': {'name': 'Other Fees', 'category': 'Professional Fees', 'type': 'OPEX'},
+    
+    # General & Administrative
+    '61511': {'name': 'Printing', 'category': 'General & Administrative', 'type': 'OPEX'},
+    '61512': {'name': 'Stationeries and Office Supplies', 'category': 'General & Administrative', 'type': 'OPEX'},
+    '61513': {'name': 'Telephone and Faxes', 'category': 'General & Administrative', 'type': 'OPEX'},
+    '61514': {'name': 'Utility', 'category': 'General & Administrative', 'type': 'OPEX'},
+    '61515': {'name': 'Postage & Courier', 'category': 'General & Administrative', 'type': 'OPEX'},
+    '61516': {'name': 'Entertainment - Staff', 'category': 'General & Administrative', 'type': 'OPEX'},
+    '61517': {'name': 'Entertainment - Business', 'category': 'General & Administrative', 'type': 'OPEX'},
+    '61522': {'name': 'Rental - Warehouse', 'category': 'General & Administrative', 'type': 'OPEX'},
+    '61526': {'name': 'Maintainance - Others', 'category': 'General & Administrative', 'type': 'OPEX'},
+    '61527': {'name': 'Refreshments', 'category': 'General & Administrative', 'type': 'OPEX'},
+    '61532': {'name': 'Staff Welfare', 'category': 'General & Administrative', 'type': 'OPEX'},
+    '61535': {'name': 'Maintenance - Office Equipment', 'category': 'General & Administrative', 'type': 'OPEX'},
+    '61549': {'name': 'Other Office Expenses', 'category': 'General & Administrative', 'type': 'OPEX'},
+    '61552': {'name': 'Communication Service - Internet Access Fee', 'category': 'IT Expenses', 'type': 'OPEX'},
+    '61554': {'name': 'Hosted System', 'category': 'IT Expenses', 'type': 'OPEX'},
+    '61556': {'name': 'Maintenance - Computer Software', 'category': 'IT Expenses', 'type': 'OPEX'},
+    '61557': {'name': 'License Fee - Computer Software', 'category': 'IT Expenses', 'type': 'OPEX'},
+    '61558': {'name': 'Web Services', 'category': 'IT Expenses', 'type': 'OPEX'},
+    '61569': {'name': 'Other IT Expenses', 'category': 'IT Expenses', 'type': 'OPEX'},
+    
+    # Other Operating Expenses
+    '61713': {'name': 'FA Expensed Off', 'category': 'Other Operating Expenses', 'type': 'OPEX'},
+    '61714': {'name': 'Provision for Doubtful Debts', 'category': 'Other Operating Expenses', 'type': 'OPEX'},
+    '61716': {'name': 'Provision for Impairment PPE', 'category': 'Other Operating Expenses', 'type': 'OPEX'},
+    '61720': {'name': 'AEP Expenses', 'category': 'Other Operating Expenses', 'type': 'OPEX'},
+    '61724': {'name': 'Rounding Account', 'category': 'Other Operating Expenses', 'type': 'OPEX'},
+    '61727': {'name': 'Bad Debts Written Off', 'category': 'Other Operating Expenses', 'type': 'OPEX'},
+    '61725': {'name': 'Imported Service Tax Expense', 'category': 'Other Operating Expenses', 'type': 'OPEX'},
+    '617A6': {'name': 'Provision for Impairment of Investment', 'category': 'Other Operating Expenses', 'type': 'OPEX'},
+    
+    # Depreciation & Amortization
+    '61629': {'name': 'Depreciation - Computer Hardware', 'category': 'Depreciation & Amortization', 'type': 'D&A'},
+    '61630': {'name': 'Depreciation - Computer Software', 'category': 'Depreciation & Amortization', 'type': 'D&A'},
+    '61685': {'name': 'Amortisation - Intangibles', 'category': 'Depreciation & Amortization', 'type': 'D&A'},
+    
+    # Interest & Financial
+    '71111': {'name': 'Interest Income - Bank Interest', 'category': 'Interest Income', 'type': 'Interest'},
+    '71121': {'name': 'Term Loan Interest', 'category': 'Interest Expense', 'type': 'Interest'},
+    '71130': {'name': 'Lease Interest - IFRS 16', 'category': 'Interest Expense', 'type': 'Interest'},
+    '71141': {'name': 'Bank Charges', 'category': 'Financial Charges', 'type': 'Interest'},
+    '71142': {'name': 'Bank Guarantee Charges', 'category': 'Financial Charges', 'type': 'Interest'},
+    '71149': {'name': 'Other Financial Charges', 'category': 'Financial Charges', 'type': 'Interest'},
+    
+    # Non-Operating
+    '81111': {'name': 'FOREX - Realised Gain /(Loss)', 'category': 'Forex', 'type': 'Non-Operating'},
+    '81121': {'name': 'FOREX - Unrealised Gain/(Loss)', 'category': 'Forex', 'type': 'Non-Operating'},
+}
+
+GL_ATTRIBUTES = ['name', 'category', 'type']
+
+def compile_gl_lookup(mapping):
+    """Compile the GL mapping into a columnar lookup table keyed by gl_code"""
+    lookup = pd.DataFrame.from_dict(mapping, orient='index', columns=GL_ATTRIBUTES)
+    for col in GL_ATTRIBUTES:
+        # 'Unknown' is a category up front so unmapped codes never need a dtype change
+        categories = pd.Index(lookup[col].unique()).append(pd.Index(['Unknown'])).unique()
+        lookup[col] = pd.Categorical(lookup[col], categories=categories)
+    return lookup
+
+GL_LOOKUP = compile_gl_lookup(GL_CODE_MAPPING)
+
+def map_gl_codes(gl_codes):
+    """Look up name/category/type for a Series of GL codes in one vectorized pass"""
+    # Resolve only the distinct codes against the lookup, then broadcast back to rows
+    codes, uniques = pd.factorize(gl_codes)
+    positions = np.append(GL_LOOKUP.index.get_indexer(uniques), -1)[codes]
+    
+    mapped = {}
+    for col in GL_ATTRIBUTES:
+        dtype = GL_LOOKUP[col].dtype
+        category_codes = np.where(positions >= 0,
+                                  GL_LOOKUP[col].cat.codes.to_numpy()[positions],
+                                  dtype.categories.get_loc('Unknown'))
+        mapped[col] = pd.Categorical.from_codes(category_codes, dtype=dtype)
+    return pd.DataFrame(mapped, index=gl_codes.index)
+
+# Lower-cased GL code and account name per GL_LOOKUP row, for searching accounts instead of rows
+GL_SEARCH_KEYS = pd.DataFrame({'code': GL_LOOKUP.index.str.lower(),
+                               'name': GL_LOOKUP['name'].astype(str).str.lower()}, index=GL_LOOKUP.index)
+
+def search_gl_codes(term):
+    """GL codes whose code or account name contains term (case-insensitive, literal); O(accounts)"""
+    term = term.lower()
+    hits = (GL_SEARCH_KEYS['code'].str.contains(term, regex=False) |
+            GL_SEARCH_KEYS['name'].str.contains(term, regex=False))
+    return GL_SEARCH_KEYS.index[hits.to_numpy()]
+
+# P&L lines that feed the metrics; Interest is split by category into income and expense
+PL_LINES = ['Revenue', 'COGS', 'OPEX', 'D&A', 'Interest Income', 'Interest Expense', 'Non-Operating']
+
+# Fixed-point ledgers hold int64 amounts in minor units (cents)
+AMOUNT_SCALE = 100
+
+def to_minor_units(amounts):
+    """Parse amounts once into int64 minor units; exact for 2-decimal values below ~9e13"""
+    return np.round(pd.to_numeric(amounts).fillna(0) * AMOUNT_SCALE).astype('int64')
+
+def amount_scale(frame):
+    """Minor units per currency unit of a ledger or aggregate: AMOUNT_SCALE when fixed-point, else 1
+    
+    The mode travels explicitly in attrs (see with_amount_scale) and is never inferred from the
+    amount dtype, so a float ledger with whole-number amounts is not mistaken for cents.
+    """
+    return frame.attrs.get('amount_scale', 1)
+
+def with_amount_scale(frame, scale):
+    """Flag a ledger or aggregate as holding amounts in 1/scale units (scale 1: currency units)"""
+    if scale == 1:
+        frame.attrs.pop('amount_scale', None)
+    else:
+        frame.attrs['amount_scale'] = scale
+    return frame
+
+def amount_units(amounts, scale):
+    """Amounts in currency units for display and export (fixed-point amounts are converted and unflagged)"""
+    return with_amount_scale(amounts / scale, 1) if scale != 1 else amounts
+
+def sum_amounts(df, by, minor_units=False):
+    """Grouped amount totals in currency units
+    
+    float32 (compact) amounts are accumulated in float64; fixed-point amounts are summed
+    exactly in int64 and converted once at the end, or kept as minor units (flagged with
+    their scale) with minor_units=True.
+    """
+    keys = [by] if isinstance(by, str) else list(by)
+    amounts = df['amount']
+    if amounts.dtype == 'float32':
+        amounts = amounts.astype('float64')
+    sums = amounts.groupby([df[k] for k in keys], observed=True).sum()
+    scale = amount_scale(df)
+    return with_amount_scale(sums, scale) if minor_units else amount_units(sums, scale)
+
+def type_totals(totals, types):
+    """Rows of a (type, category) rollup_slice for the given account types"""
+    return totals[totals.index.get_level_values('type').isin(types)]
+
+def with_accounts(totals):
+    """Prefix GL-level totals with each account's name/category/type from GL_LOOKUP"""
+    if 'gl_code' not in totals.index.names:
+        return totals
+    codes = totals.index.get_level_values('gl_code').astype(str)
+    accounts = GL_LOOKUP.reindex(codes).set_axis(totals.index)
+    return pd.concat([accounts, totals], axis=1)
+
+# Levels of the GL hierarchy, top down
+ROLLUP_LEVELS = ['type', 'category', 'gl_code']
+
+def rollup_cube(df, period_col='month_name'):
+    """Signed amounts over the GL hierarchy and period, with a subtotal series at every level
+    
+    Returns {level: Series} for each ROLLUP_LEVELS entry, indexed by the hierarchy down to
+    that level (plus period_col when the ledger has it). Only the gl_code level reads the rows;
+    the category and type subtotals are rolled up from it. Codes missing from GL_CODE_MAPPING
+    have no place in the hierarchy and are left out.
+    """
+    period = [period_col] if period_col in df.columns else []
+    leaf = sum_amounts(df, ROLLUP_LEVELS + period, minor_units=True)
+    cube = {'gl_code': leaf}
+    for depth in (2, 1):
+        cube[ROLLUP_LEVELS[depth - 1]] = leaf.groupby(level=ROLLUP_LEVELS[:depth] + period, observed=True).sum()
+    return {level: amount_units(cube[level], amount_scale(df)) for level in ROLLUP_LEVELS}
+
+def rollup_slice(cube, level, periods=None, **parents):
+    """Totals at one level of a rollup_cube, over the given periods (default all)
+    
+    parents narrows the slice to members of higher levels, e.g. category='Direct Payroll' to drill from a
+    category into its GL codes; each value is a label or a list of labels.
+    """
+    totals = cube[level]
+    mask = np.ones(len(totals), dtype=bool)
+    for parent, members in parents.items():
+        members = [members] if isinstance(members, str) else list(members)
+        mask &= totals.index.get_level_values(parent).isin(members)
+    hierarchy = ROLLUP_LEVELS[:ROLLUP_LEVELS.index(level) + 1]
+    if totals.index.nlevels > len(hierarchy):
+        period_col = totals.index.names[-1]
+        if periods is not None:
+            mask &= totals.index.get_level_values(period_col).isin(list(periods))
+        return totals[mask].groupby(level=hierarchy, observed=True).sum()
+    return totals[mask]
+
+def view_gl_totals(cube, periods=None, **parents):
+    """Per-GL totals of a cube slice as a frame with an 'amount' column and account attributes"""
+    gl_totals = rollup_slice(cube, 'gl_code', periods, **parents)
+    return with_accounts(gl_totals.droplevel(['type', 'category']).to_frame())
+
+def select_top(values, n, largest=True):
+    """Positions of the n largest (or smallest) values in rank order, via partial selection
+    
+    Ties keep their original order, so a tie at the cutoff resolves to the earlier entries.
+    """
+    values = np.asarray(values, dtype='float64')
+    n = min(n, len(values))
+    if n <= 0:
+        return np.empty(0, dtype=np.intp)
+    keyed = -values if largest else values
+    keyed = np.where(np.isnan(keyed), np.inf, keyed)
+    cutoff = np.partition(keyed, n - 1)[n - 1]
+    candidates = np.flatnonzero(keyed <= cutoff)
+    return candidates[np.argsort(keyed[candidates], kind='stable')][:n]
+
+def rank_totals(totals, n=10, bottom=False, signed=False, pareto=None):
+    """Top (or bottom) n rows of a view_gl_totals frame by magnitude, or its Pareto set
+    
+    signed ranks by the signed amount instead of its magnitude. pareto (e.g. 0.8) returns the
+    largest rows that together reach that share of the total magnitude; n is then ignored.
+    """
+    amounts = totals['amount'].to_numpy(dtype='float64')
+    values = amounts if signed else np.abs(amounts)
+    if pareto is None:
+        return totals.iloc[select_top(values, n, largest=not bottom)]
+    
+    order = np.argsort(-np.abs(amounts), kind='stable')
+    cumulative = np.cumsum(np.abs(amounts)[order])
+    if len(order) == 0 or cumulative[-1] == 0:
+        return totals.iloc[:0]
+    cutoff = np.searchsorted(cumulative / cumulative[-1], pareto) + 1
+    return totals.iloc[order[:cutoff]]
+
+def safe_ratio(numerator, denominator, scale=100.0, zero=np.nan, magnitude=False):
+    """Vectorized numerator / denominator x scale (a percentage by default) with defined edge cases
+    
+    A zero denominator gives `zero` (NaN unless a caller wants e.g. a 0% margin) instead of
+    inf; magnitude=True divides by |denominator| so the sign follows the numerator when the
+    base is negative (growth out of a loss reads as an improvement). Works on scalars, arrays,
+    Series and frames.
+    """
+    if not isinstance(numerator, (pd.Series, pd.DataFrame)) and not isinstance(denominator, (pd.Series, pd.DataFrame)):
+        numerator, denominator = np.asarray(numerator, dtype='float64'), np.asarray(denominator, dtype='float64')
+    base = abs(denominator) if magnitude else denominator
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = numerator / base * scale
+    valid = denominator != 0
+    if isinstance(ratio, (pd.Series, pd.DataFrame)):
+        return ratio.where(valid if np.ndim(valid) else np.full(ratio.shape, bool(valid)), zero)
+    ratio = np.where(valid, ratio, zero)
+    return float(ratio) if ratio.ndim == 0 else ratio
+
+def aggregate_pl_lines(df, by=None):
+    """Sum amounts into P&L lines with a single grouped reduction over type/category"""
+    keys = ([by] if by else []) + ['type', 'category']
+    sums = sum_amounts(df, keys, minor_units=True).reset_index()
+    
+    # Map each (type, category) pair onto its P&L line - only touches the grouped result
+    line = sums['type'].astype(object)
+    is_interest = line == 'Interest'
+    line[is_interest] = np.where(sums.loc[is_interest, 'category'] == 'Interest Income',
+                                 'Interest Income', 'Interest Expense')
+    sums['line'] = line
+    
+    if by:
+        lines = sums.pivot_table(index=by, columns='line', values='amount', aggfunc='sum', observed=True)
+    else:
+        lines = sums.groupby('line')['amount'].sum().to_frame().T
+    lines = lines.reindex(columns=PL_LINES).fillna(0)
+    scale = amount_scale(df)
+    return with_amount_scale(lines.astype('int64') if scale != 1 else lines, scale)
+
+def derive_metrics(lines):
+    """Derive profit and margin metrics from P&L line totals (one row per group)
+    
+    Fixed-point (int64) line totals stay integral through the profit arithmetic; amounts are
+    converted to currency units only at the end.
+    """
+    metrics = pd.DataFrame(index=lines.index)
+    revenue = lines['Revenue']
+    
+    def margin(profit):
+        return safe_ratio(profit, revenue, zero=0.0)
+    
+    metrics['total_revenue'] = revenue
+    metrics['total_cogs'] = lines['COGS'].abs()
+    metrics['gross_profit'] = metrics['total_revenue'] - metrics['total_cogs']
+    metrics['gross_margin'] = margin(metrics['gross_profit'])
+    metrics['total_opex'] = lines['OPEX'].abs()
+    metrics['ebitda'] = metrics['gross_profit'] - metrics['total_opex']
+    metrics['ebitda_margin'] = margin(metrics['ebitda'])
+    metrics['total_da'] = lines['D&A'].abs()
+    metrics['ebit'] = metrics['ebitda'] - metrics['total_da']
+    metrics['ebit_margin'] = margin(metrics['ebit'])
+    metrics['net_interest'] = lines['Interest Income'] - lines['Interest Expense'].abs()
+    metrics['non_operating'] = lines['Non-Operating']
+    metrics['pbt'] = metrics['ebit'] + metrics['net_interest'] + metrics['non_operating']
+    metrics['pbt_margin'] = margin(metrics['pbt'])
+    if amount_scale(lines) != 1:
+        amounts = [c for c in metrics.columns if not c.endswith('_margin')]
+        metrics[amounts] = metrics[amounts] / amount_scale(lines)
+    return metrics
+
+def calculate_metrics(df):
+    """Calculate key financial metrics"""
+    return derive_metrics(aggregate_pl_lines(df)).iloc[0].to_dict()
+
+def calculate_metrics_by_period(df, period_col='month_name'):
+    """Calculate key financial metrics for every period from one pivot (one row per period)"""
+    return derive_metrics(aggregate_pl_lines(df, by=period_col)).sort_index()
+
+def rollup_lines_by_period(cube):
+    """Signed P&L line totals per period (aggregate_pl_lines by period) read from a rollup_cube's category level"""
+    totals = cube['category']
+    return aggregate_pl_lines(totals.reset_index(), by=totals.index.names[-1]).sort_index()
+
+# Margin metrics and the profit line each one divides by revenue
+MARGIN_PROFITS = {'gross_margin': 'gross_profit', 'ebitda_margin': 'ebitda', 'ebit_margin': 'ebit', 'pbt_margin': 'pbt'}
+
+# Windowed bases for per-period P&L lines: lines over a gap-free monthly index -> windowed lines
+METRIC_WINDOWS = {
+    'Month': lambda lines, months: lines,
+    'QTD': lambda lines, months: lines.groupby([months.year, months.quarter]).cumsum(),
+    'YTD': lambda lines, months: lines.groupby(months.year).cumsum(),
+    'LTM': lambda lines, months: lines.rolling(12).sum(),
+    'Rolling 3M avg': lambda lines, months: lines.rolling(3).mean(),
+}
+
+def _monthly_window(lines_by_period, basis):
+    """Metrics of the windowed P&L lines over every month from the first to the last period (gaps count as zero)"""
+    months = pd.PeriodIndex(pd.to_datetime(lines_by_period.index.astype(str), format='%b %Y'), freq='M')
+    calendar = pd.period_range(months.min(), months.max(), freq='M')
+    lines = amount_units(lines_by_period.astype('float64'), amount_scale(lines_by_period))
+    monthly = lines.set_axis(months).reindex(calendar, fill_value=0.0)
+    
+    # Windows sum the signed lines; costs are only made positive (and margins taken) afterwards,
+    # so a month with a net credit on a cost line nets off inside the window as it does in calculate_metrics
+    return derive_metrics(METRIC_WINDOWS[basis](monthly, calendar)), months
+
+def window_metrics(lines_by_period, basis):
+    """Per-period metrics restated on a METRIC_WINDOWS basis (QTD, YTD, LTM, rolling 3-month average)
+    
+    lines_by_period holds signed P&L lines per period label (aggregate_pl_lines by period or
+    rollup_lines_by_period). Lines are additive, so each window is one cumulative or rolling pass
+    followed by derive_metrics - linear in the number of periods, with no per-window recalculation.
+    LTM and rolling rows are NaN until the ledger covers a full window of months.
+    """
+    windowed, months = _monthly_window(lines_by_period, basis)
+    return windowed.loc[months].set_axis(lines_by_period.index)
+
+def metric_growth(lines_by_period, lag=12, basis='Month'):
+    """Growth of every metric against the same basis lag months earlier (12: YoY, 1: MoM)
+    
+    Amounts grow in % of the earlier magnitude (NaN without an earlier non-zero value);
+    margins change in percentage points.
+    """
+    windowed, months = _monthly_window(lines_by_period, basis)
+    earlier = windowed.shift(lag)
+    growth = safe_ratio(windowed - earlier, earlier, magnitude=True)
+    margins = list(MARGIN_PROFITS)
+    growth[margins] = windowed[margins] - earlier[margins]
+    return growth.loc[months].set_axis(lines_by_period.index)
+
+# Trend table columns and the metrics behind them
+TREND_COLUMNS = {
+    'total_revenue': 'Revenue',
+    'gross_profit': 'Gross Profit',
+    'ebitda': 'EBITDA',
+    'ebit': 'EBIT',
+    'pbt': 'PBT',
+    'gross_margin': 'Gross Margin %',
+    'ebitda_margin': 'EBITDA Margin %',
+    'ebit_margin': 'EBIT Margin %',
+}
+
+# Declarative recommendation rules, evaluated against per-GL aggregates
+#   kind 'metric':    compare a metrics value (e.g. a margin) with the threshold
+#   kind 'share':     abs amount of the selected GL codes as % of the `of` metric
+#   kind 'breakdown': same per `group_by` value, for the `top` largest groups
+# Templates may use {label}, {value} (metric or %), {amount} and {savings}; savings is
+# savings_rate x savings_basis ('amount' or a metric), less target_share x revenue if set.
+# savings_kind 'uplift' marks profit improvements that are not cost savings.
+RECOMMENDATION_RULES = [
+    {
+        'kind': 'metric', 'metric': 'gross_margin', 'op': '<', 'threshold': 40,
+        'priority': 'High', 'category': 'Gross Margin',
+        'issue': "Gross margin at {value:.1f}% is below industry benchmark (40-50% for airlines)",
+        'action': "Review pricing strategy and negotiate supplier contracts for inflight products",
+        'impact': "Potential 3-5% margin improvement could add ${savings:,.0f} to bottom line",
+        'savings_basis': 'total_revenue', 'savings_rate': 0.04, 'savings_kind': 'uplift',
+    },
+    {
+        'kind': 'breakdown', 'select': {'type': 'COGS'}, 'group_by': 'category', 'top': 3,
+        'of': 'total_cogs', 'op': '>', 'threshold': 25,
+        'priority': 'High', 'category': 'COGS Optimization',
+        'issue': "{label} represents {value:.1f}% of total COGS (${amount:,.0f})",
+        'action': "Benchmark {label} against competitors and negotiate volume discounts",
+        'impact': "10% reduction could save ${savings:,.0f} annually",
+        'savings_basis': 'amount', 'savings_rate': 0.10,
+    },
+    {
+        'kind': 'share', 'select': {'category': 'Marketing & Advertising'},
+        'of': 'total_revenue', 'op': '>', 'threshold': 8,
+        'priority': 'Medium', 'category': 'Marketing Efficiency',
+        'issue': "Marketing spend at {value:.1f}% of revenue (${amount:,.0f}) exceeds benchmark (5-7%)",
+        'action': "Implement digital marketing attribution model and shift to performance-based channels",
+        'impact': "Optimizing to 6% could save ${savings:,.0f}",
+        'savings_basis': 'amount', 'savings_rate': 1.0, 'target_share': 0.06,
+    },
+    {
+        'kind': 'share', 'select': {'category': 'Flight Revenue'}, 'signed': True,
+        'of': 'total_revenue', 'op': '>', 'threshold': 80,
+        'priority': 'Medium', 'category': 'Revenue Diversification',
+        'issue': "Flight revenue represents {value:.1f}% of total - high concentration risk",
+        'action': "Develop ancillary revenue streams: baggage fees, seat selection, inflight sales, partnerships",
+        'impact': "Ancillary revenue can add 15-20% to total revenue per industry standards",
+    },
+    {
+        'kind': 'share', 'select': {'category_contains': 'Payroll'},
+        'of': 'total_revenue', 'op': '>', 'threshold': 30,
+        'priority': 'Medium', 'category': 'Labor Productivity',
+        'issue': "Personnel costs at {value:.1f}% of revenue (${amount:,.0f}) above benchmark (25-28%)",
+        'action': "Review headcount efficiency, automate processes, and optimize crew scheduling",
+        'impact': "2% improvement could save ${savings:,.0f}",
+        'savings_basis': 'amount', 'savings_rate': 0.02,
+    },
+    {
+        'kind': 'share', 'select': {'category': 'IT Expenses'},
+        'of': 'total_revenue', 'op': '<', 'threshold': 2,
+        'priority': 'Low', 'category': 'Digital Investment',
+        'issue': "IT spend at {value:.1f}% of revenue (${amount:,.0f}) below benchmark (3-5%)",
+        'action': "Increase investment in digital booking platforms, mobile apps, and data analytics",
+        'impact': "Digital transformation can improve customer experience and reduce distribution costs",
+    },
+    {
+        'kind': 'share', 'select': {'name_matches': 'Commission|Gateway|Merchant'},
+        'of': 'total_revenue', 'op': '>', 'threshold': 5,
+        'priority': 'High', 'category': 'Distribution Cost',
+        'issue': "Commission & payment fees at {value:.1f}% of revenue (${amount:,.0f})",
+        'action': "Shift to direct booking channels, renegotiate credit card fees, and optimize payment mix",
+        'impact': "1% reduction could save ${savings:,.0f}",
+        'savings_basis': 'total_revenue', 'savings_rate': 0.01,
+    },
+    {
+        'kind': 'metric', 'metric': 'ebitda_margin', 'op': '<', 'threshold': 15,
+        'priority': 'Critical', 'category': 'Overall Profitability',
+        'issue': "EBITDA margin at {value:.1f}% below healthy airline benchmark (15-20%)",
+        'action': "Implement comprehensive margin enhancement program across all cost categories",
+        'impact': "Target 18% EBITDA margin for sustainable operations and growth investment",
+    },
+]
+
+RULE_OPERATORS = {'<': np.less, '>': np.greater}
+
+PRIORITY_ORDER = {'Critical': 0, 'High': 1, 'Medium': 2, 'Low': 3}
+
+def select_gl_codes(select):
+    """Boolean mask over GL_LOOKUP rows for a rule selector (matched once per account, not per row)"""
+    mask = np.ones(len(GL_LOOKUP), dtype=bool)
+    for key, value in select.items():
+        if key in GL_ATTRIBUTES:
+            mask &= (GL_LOOKUP[key] == value).to_numpy()
+        elif key == 'category_contains':
+            mask &= GL_LOOKUP['category'].astype(str).str.contains(value, regex=False).to_numpy()
+        elif key == 'name_matches':
+            mask &= GL_LOOKUP['name'].astype(str).str.contains(value, case=False).to_numpy()
+        elif key == 'gl_codes':
+            mask &= GL_LOOKUP.index.isin(value)
+        else:
+            raise ValueError(f"Unknown rule selector: {key}")
+    return mask
+
+# Selector masks compiled once at import
+RULE_SELECTIONS = [select_gl_codes(rule['select']) if 'select' in rule else None for rule in RECOMMENDATION_RULES]
+
+def aggregate_gl_totals(df, by=None):
+    """Signed amount per GL code (one column per GL_LOOKUP code, one row per group)"""
+    if by:
+        totals = sum_amounts(df, [by, 'gl_code']).unstack('gl_code')
+    else:
+        totals = sum_amounts(df, 'gl_code').to_frame().T
+    totals.columns = totals.columns.astype(str)
+    return totals.reindex(columns=GL_LOOKUP.index).fillna(0.0)
+
+def _rule_savings(rule, amount, metrics_row):
+    """Savings figure for a triggered rule (None when the rule has no savings estimate)"""
+    if 'savings_rate' not in rule:
+        return None
+    basis = amount if rule['savings_basis'] == 'amount' else metrics_row[rule['savings_basis']]
+    return float(basis * rule['savings_rate'] - rule.get('target_share', 0) * metrics_row['total_revenue'])
+
+def _build_recommendation(rule_id, metrics_row, value, amount=None, label=None):
+    """Structured recommendation for one triggered group; text is rendered separately"""
+    rule = RECOMMENDATION_RULES[rule_id]
+    return {
+        'rule': rule_id,
+        'priority': rule['priority'],
+        'category': rule['category'],
+        'label': label,
+        'value': float(value),
+        'amount': None if amount is None else float(amount),
+        'estimated_savings': _rule_savings(rule, amount, metrics_row),
+        'savings_basis': rule.get('savings_basis'),
+        'savings_kind': rule.get('savings_kind', 'saving') if 'savings_rate' in rule else None,
+    }
+
+def render_recommendation(rec):
+    """Format a recommendation's issue/action/impact text from its rule templates"""
+    rule = RECOMMENDATION_RULES[rec['rule']]
+    fields = {'label': rec['label'], 'value': rec['value'], 'amount': rec['amount'],
+              'savings': rec['estimated_savings']}
+    return {key: rule[key].format(**fields) for key in ('issue', 'action', 'impact')}
+
+# Numeric recommendation fields, in export order
+RECOMMENDATION_FIELDS = ['priority', 'category', 'label', 'value', 'amount',
+                         'estimated_savings', 'savings_basis', 'savings_kind']
+
+def recommendations_frame(recommendations):
+    """Recommendations as a DataFrame of their structured fields (for totals, sorting and export)"""
+    return pd.DataFrame(recommendations, columns=RECOMMENDATION_FIELDS).astype(
+        {'value': 'float64', 'amount': 'float64', 'estimated_savings': 'float64'})
+
+def evaluate_recommendation_rules(gl_totals, metrics_frame):
+    """Evaluate every rule for every group at once; returns {group: [recommendation, ...]}"""
+    results = {group: [] for group in gl_totals.index}
+    amounts = gl_totals.to_numpy()
+    
+    for rule_id, (rule, selection) in enumerate(zip(RECOMMENDATION_RULES, RULE_SELECTIONS)):
+        compare = RULE_OPERATORS[rule['op']]
+        
+        if rule['kind'] == 'metric':
+            values = metrics_frame[rule['metric']].to_numpy()
+            for i in np.flatnonzero(compare(values, rule['threshold'])):
+                group = gl_totals.index[i]
+                results[group].append(_build_recommendation(rule_id, metrics_frame.loc[group], values[i]))
+            continue
+        
+        denominators = metrics_frame[rule['of']].to_numpy()
+        if rule['kind'] == 'share':
+            selected = amounts[:, selection].sum(axis=1)
+            selected = selected if rule.get('signed') else np.abs(selected)
+            values = safe_ratio(selected, denominators)
+            for i in np.flatnonzero((selected != 0) & compare(values, rule['threshold'])):
+                group = gl_totals.index[i]
+                results[group].append(_build_recommendation(rule_id, metrics_frame.loc[group], values[i], selected[i]))
+        
+        elif rule['kind'] == 'breakdown':
+            # Groups x labels matrix from the per-GL totals of the selected accounts
+            labels = GL_LOOKUP.loc[selection, rule['group_by']].astype(str)
+            by_label = pd.DataFrame(amounts[:, selection], index=gl_totals.index,
+                                    columns=labels).T.groupby(level=0).sum().T.abs()
+            for i, group in enumerate(gl_totals.index):
+                top = by_label.loc[group]
+                top = top[top != 0].nlargest(rule['top'])
+                if denominators[i] == 0:
+                    continue
+                for label, amount in top.items():
+                    value = amount / denominators[i] * 100
+                    if compare(value, rule['threshold']):
+                        results[group].append(_build_recommendation(rule_id, metrics_frame.loc[group], value, amount, label))
+    
+    for group in results:
+        results[group].sort(key=lambda r: PRIORITY_ORDER[r['priority']])
+    return results
+
+def generate_optimization_recommendations(df, metrics):
+    """Generate AI-driven optimization recommendations based on investment banking principles"""
+    metrics_frame = pd.DataFrame([metrics], index=['all'])
+    gl_totals = aggregate_gl_totals(df).set_axis(['all'])
+    return evaluate_recommendation_rules(gl_totals, metrics_frame)['all']
+
+def generate_recommendations_by_period(df, metrics_by_period, period_col='month_name'):
+    """Recommendations for every period in one batch, keyed by period label"""
+    gl_totals = aggregate_gl_totals(df, by=period_col).reindex(metrics_by_period.index, fill_value=0.0)
+    return evaluate_recommendation_rules(gl_totals, metrics_by_period)
+
+# Normalised source columns the app reads; everything else in a workbook is skipped
+LEDGER_COLUMNS = {'gl_code', 'gl code', 'amount', 'month', 'period'}
+
+# Excel engines in order of preference, with the module that provides each
+EXCEL_ENGINES = [('calamine', 'python_calamine'), ('openpyxl', 'openpyxl')]
+
+def fastest_excel_engine():
+    """Pick the fastest installed Excel engine (None lets pandas choose)"""
+    for engine, module in EXCEL_ENGINES:
+        if importlib.util.find_spec(module) is not None:
+            return engine
+    return None
+
+def normalize_columns(raw_df):
+    """Lower-case and strip column names and standardise 'gl code' to 'gl_code'"""
+    raw_df.columns = raw_df.columns.astype(str).str.lower().str.strip()
+    if 'gl code' in raw_df.columns:
+        raw_df.rename(columns={'gl code': 'gl_code'}, inplace=True)
+    return raw_df
+
+def is_ledger_column(name):
+    """Whether a source column is one the app reads (usecols filter for workbook parses)"""
+    return str(name).lower().strip() in LEDGER_COLUMNS
+
+def read_excel_sheet(workbook, sheet_name, month_from_sheet=False):
+    """Read one worksheet of an open pd.ExcelFile in a single parse, projecting only the ledger columns
+    
+    Cells come back as raw objects and are typed afterwards: GL codes as text (so 41110 never
+    becomes 41110.0), amounts as float64, anything else (month/period) inferred.
+    """
+    sheet_df = workbook.parse(sheet_name, usecols=is_ledger_column, dtype=object)
+    dtype = {}
+    for c in sheet_df.columns:
+        key = str(c).lower().strip()
+        if key in ('gl_code', 'gl code'):
+            dtype[c] = str
+        elif key == 'amount':
+            dtype[c] = 'float64'
+    sheet_df = normalize_columns(sheet_df.astype(dtype).infer_objects())
+    
+    # One-sheet-per-month workbooks carry the period in the sheet name
+    if month_from_sheet and 'month' not in sheet_df.columns and 'period' not in sheet_df.columns:
+        sheet_df['month'] = str(sheet_name)
+    return sheet_df
+
+def read_excel_sheets(file_bytes, sheet_names, engine=None, month_from_sheet=False):
+    """Read several worksheets from one workbook opened once (a process pool task)"""
+    with pd.ExcelFile(io.BytesIO(file_bytes), engine=engine) as workbook:
+        return [read_excel_sheet(workbook, s, month_from_sheet) for s in sheet_names]
+
+def excel_sheet_names(file_bytes, engine=None):
+    """List the worksheets in an Excel upload"""
+    with pd.ExcelFile(io.BytesIO(file_bytes), engine=engine) as workbook:
+        return workbook.sheet_names
+
+def read_excel_ledger(file_bytes, sheet_name=0, engine=None, workers=None):
+    """Read an Excel ledger; sheet_name=None (or a list) reads those sheets into one frame
+    
+    Excel parsing holds the GIL, so several sheets are split into contiguous groups across
+    worker processes (default: CPU count), each opening the workbook once; with one worker
+    they are read serially from a single open workbook.
+    """
+    engine = engine or fastest_excel_engine()
+    if isinstance(sheet_name, (str, int)):
+        return read_excel_sheets(file_bytes, [sheet_name], engine)[0]
+    
+    with pd.ExcelFile(io.BytesIO(file_bytes), engine=engine) as workbook:
+        sheets = workbook.sheet_names if sheet_name is None else list(sheet_name)
+        workers = min(len(sheets), workers or os.cpu_count() or 1)
+        if workers <= 1:
+            frames = [read_excel_sheet(workbook, s, month_from_sheet=True) for s in sheets]
+            return pd.concat(frames, ignore_index=True)
+    
+    groups = [sheets[i * len(sheets) // workers:(i + 1) * len(sheets) // workers] for i in range(workers)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(read_excel_sheets, [file_bytes] * workers, groups, [engine] * workers,
+                           [True] * workers)
+        frames = [frame for group in results for frame in group]
+    return pd.concat(frames, ignore_index=True)
+
+def read_ledger(file_bytes, file_name, sheet_name=0):
+    """Read an uploaded CSV or Excel file into a raw DataFrame"""
+    if file_name.endswith('.csv'):
+        return pd.read_csv(io.BytesIO(file_bytes))
+    return read_excel_ledger(file_bytes, sheet_name)
+
+# Period formats tried in order against each distinct value (sidebar: 2024-01, Jan-2024, January 2024)
+PERIOD_FORMATS = ['%Y-%m', '%b-%Y', '%B %Y', '%b %Y', '%B-%Y', '%Y-%m-%d', '%Y/%m', '%m/%Y', '%d/%m/%Y']
+
+def parse_periods(values):
+    """Parse a period column once per distinct value and map the results back to rows"""
+    codes, uniques = pd.factorize(values)
+    if pd.api.types.is_datetime64_any_dtype(uniques):
+        parsed = pd.Series(uniques)
+    else:
+        text = pd.Series(uniques, dtype=object).astype(str).str.strip()
+        parsed = pd.Series(pd.NaT, index=text.index, dtype='datetime64[ns]')
+        for fmt in PERIOD_FORMATS:
+            pending = parsed.isna()
+            if not pending.any():
+                break
+            parsed[pending] = pd.to_datetime(text[pending], format=fmt, errors='coerce')
+        
+        # Anything still unparsed (e.g. Excel timestamps stored as text) gets per-value inference
+        pending = parsed.isna()
+        if pending.any():
+            parsed[pending] = pd.to_datetime(text[pending], format='mixed', errors='coerce')
+    
+    # Index -1 (missing source value) picks the trailing NaT
+    lookup = np.append(parsed.to_numpy(dtype='datetime64[ns]'), np.datetime64('NaT'))
+    return pd.Series(lookup[codes], index=values.index, name='period')
+
+def period_columns(periods):
+    """Ordered categorical month_name/year_month columns for a datetime Series"""
+    codes, uniques = pd.factorize(periods.dt.to_period('M'), sort=True)
+    months = pd.PeriodIndex(uniques, freq='M')
+    month_name = pd.Categorical.from_codes(codes, categories=months.strftime('%b %Y'), ordered=True)
+    year_month = pd.Categorical.from_codes(codes, categories=months.strftime('%Y-%m'), ordered=True)
+    return (pd.Series(month_name, index=periods.index, name='month_name'),
+            pd.Series(year_month, index=periods.index, name='year_month'))
+
+def parse_ledger_periods(raw_df):
+    """Parse the month/period column into period/month_name/year_month; returns (df, has_time_dimension)
+    
+    Rows whose period cannot be parsed are dropped.
+    """
+    has_time_dimension = False
+    if 'month' in raw_df.columns:
+        raw_df['period'] = parse_periods(raw_df['month'])
+        has_time_dimension = True
+    elif 'period' in raw_df.columns:
+        raw_df['period'] = parse_periods(raw_df['period'])
+        has_time_dimension = True
+    
+    if has_time_dimension:
+        raw_df = raw_df.dropna(subset=['period'])
+        raw_df['month_name'], raw_df['year_month'] = period_columns(raw_df['period'])
+    return raw_df, has_time_dimension
+
+def enrich_ledger(raw_df):
+    """Map GL codes onto name/category/type and drop unknown codes; returns (df, unknown_codes)"""
+    # Convert GL codes to string
+    raw_df['gl_code'] = raw_df['gl_code'].astype(str).str.strip()
+    
+    # Map GL codes to categories
+    raw_df[GL_ATTRIBUTES] = map_gl_codes(raw_df['gl_code'])
+    
+    # Filter out unknown codes
+    known = raw_df['type'] != 'Unknown'
+    unknown_codes = raw_df.loc[~known, 'gl_code'].unique()
+    return raw_df[known], unknown_codes
+
+def prepare_ledger(raw_df, fixed_point=False):
+    """Normalise columns, parse periods and map GL codes; returns (df, unknown_codes, has_time_dimension)
+    
+    Amounts are parsed as float64, or with fixed_point into int64 minor units (see
+    to_minor_units) and the ledger flagged with AMOUNT_SCALE.
+    """
+    # Normalize column names
+    raw_df = normalize_columns(raw_df)
+    
+    # Check for required columns
+    if 'gl_code' not in raw_df.columns and 'gl code' not in raw_df.columns:
+        raise ValueError("File must contain 'gl_code' or 'GL Code' column")
+    
+    if 'amount' not in raw_df.columns:
+        raise ValueError("File must contain 'amount' or 'Amount' column")
+    
+    if fixed_point:
+        raw_df['amount'] = to_minor_units(raw_df['amount'])
+    else:
+        raw_df['amount'] = pd.to_numeric(raw_df['amount']).astype('float64')
+    
+    raw_df, has_time_dimension = parse_ledger_periods(raw_df)
+    df, unknown_codes = enrich_ledger(raw_df)
+    return with_amount_scale(df, AMOUNT_SCALE if fixed_point else 1), unknown_codes, has_time_dimension
+
+# Columns a compact ledger keeps; source-only columns (raw month text, extras) are dropped
+COMPACT_COLUMNS = ['entity', 'gl_code', 'amount', 'line_count', 'period', 'month_name', 'year_month',
+                   'name', 'category', 'type']
+
+def compact_ledger(df, amount_dtype='float32'):
+    """Shrink an enriched ledger: categorical keys, downcast amounts, no source-only columns"""
+    df = df[[c for c in COMPACT_COLUMNS if c in df.columns]]
+    dtypes = {c: 'category' for c in ('entity', 'gl_code', 'period')
+              if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype)}
+    if amount_scale(df) == 1:
+        dtypes['amount'] = amount_dtype
+    if 'line_count' in df.columns:
+        dtypes['line_count'] = 'int32'
+    return df.astype(dtypes).reset_index(drop=True)
+
+def memory_report(df):
+    """Bytes per column (deep, including category labels), largest first"""
+    usage = df.memory_usage(deep=True, index=True)
+    report = pd.DataFrame({'dtype': df.dtypes.astype(str).reindex(usage.index).fillna('index'),
+                           'bytes': usage})
+    return report.sort_values('bytes', ascending=False)
+
+def peak_rss_bytes():
+    """Peak resident set size of this process so far (None where the platform lacks resource)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+# Rows serialised per chunk when exporting a ledger to CSV
+EXPORT_CHUNK_ROWS = 100_000
+
+def ledger_csv(df, chunk_rows=EXPORT_CHUNK_ROWS):
+    """CSV bytes of a ledger (amounts in currency units), written to a temporary file chunk by chunk"""
+    with tempfile.TemporaryFile() as out:
+        for start in range(0, max(len(df), 1), chunk_rows):
+            chunk = df.iloc[start:start + chunk_rows]
+            chunk.assign(amount=amount_units(chunk['amount'], amount_scale(df))).to_csv(out, header=(start == 0),
+                                                                                          index=False)
+        out.seek(0)
+        return out.read()
+
+def index_periods(df):
+    """Sort a ledger chronologically and index the contiguous row block of each period
+    
+    Returns (df, period_index) where period_index is keyed by the month_name label and
+    holds the monthly Period plus the [start, stop) row offsets of that period in df.
+    """
+    df = df.assign(month_name=df['month_name'].cat.remove_unused_categories(),
+                   year_month=df['year_month'].cat.remove_unused_categories())
+    codes = df['month_name'].cat.codes.to_numpy()
+    df = df.iloc[np.argsort(codes, kind='stable')].reset_index(drop=True)
+    
+    labels = df['month_name'].cat.categories
+    stops = np.cumsum(np.bincount(codes, minlength=len(labels)))
+    period_index = pd.DataFrame({
+        'period': pd.PeriodIndex(df['year_month'].cat.categories, freq='M'),
+        'start': stops - np.bincount(codes, minlength=len(labels)),
+        'stop': stops,
+    }, index=pd.Index(labels, name='month_name'))
+    return df, period_index
+
+def slice_periods(df, period_index, labels):
+    """Rows for the given period labels, taken as contiguous blocks in chronological order"""
+    blocks = period_index.loc[list(labels)].sort_values('start')
+    if len(blocks) == 1:
+        return df.iloc[blocks['start'].iloc[0]:blocks['stop'].iloc[0]]
+    return df.iloc[np.concatenate([np.arange(start, stop) for start, stop in zip(blocks['start'], blocks['stop'])])]
+
+def index_gl_rows(gl_codes):
+    """Group row positions by GL code so code lookups never scan the ledger
+    
+    Returns (positions, gl_index) where gl_index is keyed by gl_code and holds the
+    [start, stop) range of that code's row positions within positions.
+    """
+    codes, uniques = pd.factorize(gl_codes)
+    counts = np.bincount(codes, minlength=len(uniques))
+    stops = np.cumsum(counts)
+    gl_index = pd.DataFrame({'start': stops - counts, 'stop': stops},
+                            index=pd.Index(np.asarray(uniques).astype(str), name='gl_code'))
+    return np.argsort(codes, kind='stable'), gl_index
+
+def gl_rows(positions, gl_index, gl_codes):
+    """Row positions (ascending) of the given GL codes, from an index_gl_rows index"""
+    blocks = gl_index.loc[gl_index.index.intersection(gl_codes)]
+    return np.sort(np.concatenate([positions[start:stop] for start, stop in zip(blocks['start'], blocks['stop'])]
+                                  + [np.empty(0, dtype=np.intp)]))
+
+# Rows read per chunk in streaming mode
+STREAM_CHUNK_ROWS = 250_000
+
+def detail_spill_path(file_hash):
+    """Location of the on-disk line-level detail for a streamed upload"""
+    return os.path.join(tempfile.gettempdir(), f"pnl_detail_{file_hash[:16]}.csv")
+
+def stream_csv_ledger(source, chunksize=STREAM_CHUNK_ROWS, spill_path=None, fixed_point=False):
+    """Read a CSV in chunks and fold each enriched chunk into per-(period, gl_code) totals
+    
+    Only the aggregated ledger is kept in memory. When spill_path is given the enriched
+    line-level rows are appended there chunk by chunk. With fixed_point the chunk totals
+    are accumulated exactly in int64 minor units.
+    """
+    totals = None
+    unknown_codes = set()
+    has_time_dimension = False
+    spill = open(spill_path, 'w', newline='') if spill_path else None
+    try:
+        for i, chunk in enumerate(pd.read_csv(source, chunksize=chunksize)):
+            chunk_df, chunk_unknown, has_time_dimension = prepare_ledger(chunk, fixed_point)
+            unknown_codes.update(chunk_unknown)
+            if spill is not None:
+                chunk_df.assign(amount=amount_units(chunk_df['amount'], amount_scale(chunk_df))).to_csv(
+                    spill, header=(i == 0), index=False)
+            
+            keys = ['year_month', 'month_name', 'gl_code'] if has_time_dimension else ['gl_code']
+            chunk_totals = chunk_df.groupby(keys, observed=True)['amount'].agg(['sum', 'size'])
+            totals = chunk_totals if totals is None else pd.concat([totals, chunk_totals]).groupby(level=keys).sum()
+    finally:
+        if spill is not None:
+            spill.close()
+    
+    if totals is None:
+        raise ValueError("File contains no rows")
+    
+    # Rebuild a ledger-shaped frame from the aggregates (one row per period and GL code)
+    df = totals.rename(columns={'sum': 'amount', 'size': 'line_count'}).reset_index()
+    if has_time_dimension:
+        df['period'] = pd.to_datetime(df['year_month'].astype(str), format='%Y-%m')
+        df['month_name'], df['year_month'] = period_columns(df['period'])
+    df[GL_ATTRIBUTES] = map_gl_codes(df['gl_code'])
+    df = with_amount_scale(df, AMOUNT_SCALE if fixed_point else 1)
+    return df, np.array(sorted(unknown_codes), dtype=object), has_time_dimension
+
+def aggregate_ledger(df):
+    """Collapse an enriched ledger to one row per (entity, period, GL code) with a line_count
+    
+    The result is shaped like a streamed ledger; entity and period keys are used when present
+    and fixed-point amounts stay in minor units.
+    """
+    keys = [k for k in ('entity', 'year_month') if k in df.columns] + ['gl_code']
+    line_count = df['line_count'] if 'line_count' in df.columns else pd.Series(1, index=df.index)
+    totals = pd.DataFrame({
+        'amount': sum_amounts(df, keys, minor_units=True),
+        'line_count': line_count.groupby([df[k] for k in keys], observed=True).sum(),
+    }).reset_index()
+    totals['gl_code'] = totals['gl_code'].astype(str)
+    if 'year_month' in totals.columns:
+        totals['period'] = pd.to_datetime(totals['year_month'].astype(str), format='%Y-%m')
+        totals['month_name'], totals['year_month'] = period_columns(totals['period'])
+    totals[GL_ATTRIBUTES] = map_gl_codes(totals['gl_code'])
+    return with_amount_scale(totals, amount_scale(df))
+
+def load_ledger_file(path, sheet_name=0, stream=False, fixed_point=False):
+    """Read and enrich a ledger file from disk; returns (df, unknown_codes, has_time_dimension)"""
+    if stream and path.endswith('.csv'):
+        return stream_csv_ledger(path, fixed_point=fixed_point)
+    with open(path, 'rb') as f:
+        return prepare_ledger(read_ledger(f.read(), os.path.basename(path), sheet_name), fixed_point)
+
+def analyze_ledger_file(path, sheet_name=0, stream=False, fixed_point=False):
+    """Run ingestion -> GL mapping -> metrics -> recommendations for one ledger file"""
+    df, unknown_codes, has_time_dimension = load_ledger_file(path, sheet_name, stream, fixed_point)
+    metrics = calculate_metrics(df)
+    result = {
+        'rows': len(df),
+        'unknown_codes': list(unknown_codes),
+        'metrics': metrics,
+        'recommendations': generate_optimization_recommendations(df, metrics),
+    }
+    if has_time_dimension:
+        metrics_by_period = calculate_metrics_by_period(df)
+        result['metrics_by_period'] = metrics_by_period
+        result['recommendations_by_period'] = generate_recommendations_by_period(df, metrics_by_period)
+    return result
@@ -0,0 +1,73 @@
+"""Budget/forecast variance: actuals aligned with a second ledger on (GL hierarchy, period)"""
+import numpy as np
+import pandas as pd
+
+from pnl_analysis import ROLLUP_LEVELS, aggregate_pl_lines, derive_metrics, rollup_slice, safe_ratio
+
+# Columns of an aligned actual/budget frame
+SCENARIOS = ['actual', 'budget']
+
+# Variance bridge from budget PBT to actual PBT: (label, metric, sign of its effect on PBT)
+BRIDGE_STEPS = [
+    ('Revenue', 'total_revenue', 1),
+    ('COGS', 'total_cogs', -1),
+    ('OPEX', 'total_opex', -1),
+    ('D&A', 'total_da', -1),
+    ('Interest', 'net_interest', 1),
+    ('Non-Op', 'non_operating', 1),
+]
+
+def cube_periods(cube):
+    """Period labels of a rollup_cube (None when the ledger has no month/period column)"""
+    totals = cube['gl_code']
+    if totals.index.nlevels == len(ROLLUP_LEVELS):
+        return None
+    return totals.index.get_level_values(-1).unique().astype(str).tolist()
+
+def align_budget(actual_cube, budget_cube, periods=None):
+    """Actual and budget GL totals side by side, joined on (type, category, gl_code, period)
+    
+    Both sides come from rollup_cube, so the join runs over the already-indexed GL x period
+    totals and never touches ledger rows. periods defaults to every period with actuals, so
+    budget months not yet reported are left out. When only one ledger has periods the join is
+    on GL code alone, over the given periods of that ledger.
+    """
+    if periods is None:
+        periods = cube_periods(actual_cube)
+    if cube_periods(actual_cube) is None or cube_periods(budget_cube) is None:
+        sides = [rollup_slice(cube, 'gl_code', periods) for cube in (actual_cube, budget_cube)]
+    else:
+        sides = [cube['gl_code'][cube['gl_code'].index.get_level_values(-1).isin(periods)]
+                 for cube in (actual_cube, budget_cube)]
+    return pd.concat(dict(zip(SCENARIOS, sides)), axis=1).fillna(0.0)
+
+def variance_frame(actual, budget):
+    """Actual, budget, variance (actual - budget) and variance % of the budget magnitude
+    
+    variance_pct is NaN where the budget is zero.
+    """
+    frame = pd.DataFrame({'actual': actual, 'budget': budget})
+    frame['variance'] = frame['actual'] - frame['budget']
+    frame['variance_pct'] = safe_ratio(frame['variance'], frame['budget'], magnitude=True)
+    return frame
+
+def metric_variance(aligned):
+    """calculate_metrics of actual and budget with their variance, one row per metric
+    
+    Margin rows carry the variance in percentage points; their variance_pct is NaN.
+    """
+    scenarios = pd.concat({s: aligned[s].rename('amount') for s in SCENARIOS}, names=['scenario'])
+    metrics = derive_metrics(aggregate_pl_lines(scenarios.reset_index(), by='scenario'))
+    metrics = metrics.reindex(SCENARIOS).fillna(0.0)
+    variance = variance_frame(metrics.loc['actual'], metrics.loc['budget'])
+    variance.loc[variance.index.str.endswith('_margin'), 'variance_pct'] = np.nan
+    return variance
+
+def category_variance(aligned):
+    """Signed actual vs budget per (type, category); a positive variance adds to profit"""
+    totals = aligned.groupby(level=['type', 'category'], observed=True).sum()
+    return variance_frame(totals['actual'], totals['budget'])
+
+def variance_bridge(metrics):
+    """Contribution of each P&L line to the PBT variance, from a metric_variance frame"""
+    return pd.Series({label: sign * metrics.at[metric, 'variance'] for label, metric, sign in BRIDGE_STEPS})